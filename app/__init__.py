@@ -1,29 +1,38 @@
-import os
-
 from flask import Flask, render_template
 
 from flask_sqlalchemy import SQLAlchemy
-import pymysql
-import config
 
-app = Flask(__name__)
+db = SQLAlchemy()
+
 
-app.config.from_object(config)
+def create_app(config="config"):
+    """
+    创建应用，config 为配置对象、模块名或字典，默认为项目根目录下的 config.py。
+    视图和表单在这里才导入，只用到模型的脚本和后台任务不必加载它们
+    """
+    app = Flask(__name__)
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    else:
+        app.config.from_object(config)
 
+    db.init_app(app)
 
-db = SQLAlchemy(app)
+    from app import cache, catalog, choices, counter, images, logwriter, metrics, permissions, suggest
+    for module in (cache, catalog, choices, counter, images, logwriter, metrics, permissions, suggest):
+        module.init_app(app)
 
-from app.home import home as home_blueprint
-from app.admin import admin as admin_blueprint
+    from app.home import home as home_blueprint
+    from app.admin import admin as admin_blueprint
 
-app.register_blueprint(home_blueprint)
-app.register_blueprint(admin_blueprint, url_prefix="/admin")
+    app.register_blueprint(home_blueprint)
+    app.register_blueprint(admin_blueprint, url_prefix="/admin")
+    app.register_error_handler(404, page_not_found)
+    return app
 
 
-@app.errorhandler(404)
 def page_not_found(error):
     """
     404
     """
     return render_template("home/404.html"), 404
- 
\ No newline at end of file
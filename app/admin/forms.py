@@ -2,11 +2,8 @@ from flask_wtf import FlaskForm
 from flask_wtf.file import FileRequired
 from wtforms import StringField, SubmitField, PasswordField, FileField, TextAreaField, SelectField, SelectMultipleField
 from wtforms.validators import DataRequired, ValidationError, EqualTo
-from app.models import Admin, Tag, Movie, Preview, Auth, Role
-
-tag_list = Tag.query.all()
-auth_list = Auth.query.all()
-role_list = Role.query.all()
+from app.choices import auth_choices, role_choices, tag_choices
+from app.models import Admin, Movie, Preview
 
 
 class LoginForm(FlaskForm):
@@ -135,7 +132,7 @@ class MovieForm(FlaskForm):
             DataRequired("请选择标签！")
         ],
         coerce=int,
-        choices=[(v.id, v.name) for v in tag_list],
+        choices=tag_choices,
         description="标签",
         render_kw={
             "class": "form-control"
@@ -323,7 +320,7 @@ class RoleForm(FlaskForm):
             DataRequired("请选择权限！")
         ],
         coerce=int,
-        choices=[(v.id, v.name) for v in auth_list],
+        choices=auth_choices,
         description="权限列表",
         render_kw={
             "class": "form-control"
@@ -382,7 +379,7 @@ class AdminForm(FlaskForm):
             DataRequired("请选择所属角色！")
         ],
         coerce=int,
-        choices=[(v.id, v.name) for v in role_list],
+        choices=role_choices,
         description="所属角色",
         render_kw={
             "class": "form-control"
@@ -1,14 +1,22 @@
-import stat
-
 from . import admin
-from flask import render_template, redirect, url_for, flash, session, request
-from app.admin.forms import LoginForm, TagForm, MovieForm, PreViewForm, PwdForm, AuthForm, RoleForm, AdminForm
+# 表单和导出在用到的视图函数中才导入，启动时不加载 wtforms/csv
+from flask import render_template, redirect, url_for, flash, session, request, abort, Response, stream_with_context
 from app.models import Admin, Tag, Movie, Preview, User, Comment, MovieCol, OpLog, AdminLog, UserLog, Auth, Role
 from functools import wraps
-from app import db, app
+from app import db
+from app.catalog import invalidate_movie, invalidate_tag
+from app.choices import invalidate_choices
+from app.logwriter import log_writer
+from app.metrics import LABELS, dashboard
+from app.partitions import log_page
+from app.permissions import invalidate_role, invalidate_rules, role_rules
+from app.search import index_movie, unindex_movie
+from app.suggest import title_index
+from app import jobs, storage, upload
+from flask_sqlalchemy import Pagination
 from werkzeug.utils import secure_filename
 import os
-import uuid
+import json
 import datetime
 
 
@@ -36,44 +44,30 @@ def admin_login_req(f):
 def admin_auth(f):
     @wraps(f)
     def decorator(*args, **kwargs):
-        admin = Admin.query.join(
-            Role
-        ).filter(
-            Role.id == Admin.role_id,
-            Admin.id == session["admin_id"]
-        ).first()
-        auths = admin.role.auths
-        auths = list(int(i) for i in auths.split(","))
-        auth_list = Auth.query.all()
-        rules = [v.url for v in auth_list for val in auths if v.id == val]
-        rules.append("/admin/")
-        rule = request.url_rule
-
-        if str(rule) not in rules:
+        if "role_id" not in session:
+            # 登录时未记录角色的旧会话
+            admin = Admin.query.get(session["admin_id"])
+            session["role_id"] = admin.role_id if admin else None
+        if str(request.url_rule) not in role_rules(session["role_id"]):
             return render_template("admin/no_auth.html")
         return f(*args, **kwargs)
 
     return decorator
 
 
-# 修改文件名称
-def change_filename(filename):
-    file_info = os.path.splitext(filename)
-    filename = datetime.datetime.now().strftime("%Y%m%d%H%M%S") + str(uuid.uuid4().hex) + file_info[1]
-    return filename
-
-
 # 首页
 @admin.route("/")
 @admin_login_req
 @admin_auth
 def index():
-    return render_template("admin/index.html")
+    totals, series = dashboard(days=7)
+    return render_template("admin/index.html", labels=LABELS, totals=totals, series=series)
 
 
 # 登录
 @admin.route("/login/", methods=["GET", "POST"])
 def login():
+    from app.admin.forms import LoginForm
     form = LoginForm()
     if form.validate_on_submit():
         data = form.data
@@ -83,12 +77,12 @@ def login():
             return redirect(url_for('admin.login'))
         session["admin"] = data["account"]
         session["admin_id"] = admin.id
-        adminlog = AdminLog(
+        session["role_id"] = admin.role_id
+        log_writer.add(
+            AdminLog,
             admin_id=admin.id,
             ip=request.remote_addr
         )
-        db.session.add(adminlog)
-        db.session.commit()
         return redirect(request.args.get("next") or url_for('admin.index'))
     return render_template("admin/login.html", form=form)
 
@@ -99,6 +93,7 @@ def login():
 def logout():
     session.pop("admin", None)
     session.pop("admin_id", None)
+    session.pop("role_id", None)
     return redirect(url_for("admin.login"))
 
 
@@ -106,6 +101,7 @@ def logout():
 @admin.route("/pwd/", methods=["GET", "POST"])
 @admin_login_req
 def pwd():
+    from app.admin.forms import PwdForm
     form = PwdForm()
     if form.validate_on_submit():
         data = form.data
@@ -124,6 +120,7 @@ def pwd():
 @admin_login_req
 @admin_auth
 def tag_add():
+    from app.admin.forms import TagForm
     form = TagForm()
     if form.validate_on_submit():
         data = form.data
@@ -137,15 +134,16 @@ def tag_add():
         )
         db.session.add(tag)
         db.session.commit()
+        invalidate_tag()
+        invalidate_choices("tag")
         flash("添加标签成功！", "ok")
-        oplog = OpLog(
+        log_writer.add(
+            OpLog,
             admin_id=session["admin_id"],
             # remote_addr是一个属性方法
             ip=request.remote_addr,
             reason="添加标签：{}".format(data["name"])
         )
-        db.session.add(oplog)
-        db.session.commit()
         return redirect(url_for("admin.tag_add"))
     return render_template("admin/tag_add.html", form=form)
 
@@ -155,6 +153,7 @@ def tag_add():
 @admin_login_req
 @admin_auth
 def tag_edit(t_id=None):
+    from app.admin.forms import TagForm
     form = TagForm()
     tag = Tag.query.get_or_404(int(t_id))
     if form.validate_on_submit():
@@ -168,6 +167,8 @@ def tag_edit(t_id=None):
         tag.name = data["name"]
         db.session.add(tag)
         db.session.commit()
+        invalidate_tag()
+        invalidate_choices("tag")
         flash("修改标签成功！", "ok")
         return redirect(url_for("admin.tag_edit", t_id=t_id))
     return render_template("admin/tag_edit.html", form=form, tag=tag)
@@ -190,49 +191,124 @@ def tag_del(t_id=None):
     tag = Tag.query.filter_by(id=t_id).first_or_404()
     db.session.delete(tag)
     db.session.commit()
+    invalidate_tag(t_id)
+    invalidate_choices("tag")
     flash("删除标签成功！", "ok")
     return redirect(url_for("admin.tag_list", page=1))
 
 
+# 保存新电影，url、cover 为已存入 storage 的文件；moov 前置、读取时长和生成缩略图交给后台任务
+def create_movie(data, url, cover):
+    movie = Movie(
+        title=data["title"],
+        url=url,
+        info=data["info"],
+        cover=cover,
+        star=int(data["star"]),
+        play_num=0,
+        comment_num=0,
+        tag_id=int(data["tag_id"]),
+        area=data["area"],
+        release_time=data["release_time"],
+        length=data["length"]
+    )
+    db.session.add(movie)
+    db.session.flush()
+    index_movie(movie)
+    db.session.commit()
+    invalidate_movie((movie.tag_id, movie.star))
+    title_index.put(movie)
+    jobs.enqueue("movie_media", movie_id=movie.id)
+    jobs.enqueue("derivatives", filename=cover, kind="cover")
+    jobs.enqueue("search_compact")
+    return movie
+
+
 # 添加电影
 @admin.route("/movie/add/", methods=["GET", "POST"])
 @admin_login_req
 def movie_add():
+    from app.admin.forms import MovieForm
     form = MovieForm()
     if form.validate_on_submit():
         data = form.data
-        url_filename = secure_filename(form.url.data.filename)
-        cover_filename = secure_filename(form.cover.data.filename)
-
-        if not os.path.exists(app.config["UP_DIR"]):
-            # 创建一个多级目录
-            os.makedirs(app.config["UP_DIR"])
-            os.chmod(app.config["UP_DIR"], stat.S_IRWXU)
-
-        url = change_filename(url_filename)
-        cover = change_filename(cover_filename)
-        form.url.data.save(app.config["UP_DIR"] + url)
-        form.cover.data.save(app.config["UP_DIR"] + cover)
-        movie = Movie(
-            title=data["title"],
-            url=url,
-            info=data["info"],
-            cover=cover,
-            star=int(data["star"]),
-            play_num=0,
-            comment_num=0,
-            tag_id=int(data["tag_id"]),
-            area=data["area"],
-            release_time=data["release_time"],
-            length=data["length"]
-        )
-        db.session.add(movie)
-        db.session.commit()
+        url = storage.save(form.url.data)
+        cover = storage.save(form.cover.data)
+        create_movie(data, url, cover)
         flash("添加电影成功！", "ok")
         return redirect(url_for("admin.movie_add"))
     return render_template("admin/movie_add.html", form=form)
 
 
+# 分块上传：开始
+@admin.route("/upload/init/", methods=["POST"])
+@admin_login_req
+def upload_init():
+    try:
+        data = upload.init(
+            secure_filename(request.form.get("filename", "")),
+            request.form.get("size", 0),
+            request.form.get("chunk_size")
+        )
+    except (upload.UploadError, ValueError) as e:
+        return json.dumps(dict(ok=0, msg=str(e))), 400
+    data["ok"] = 1
+    return json.dumps(data)
+
+
+# 分块上传：状态，用于断点续传
+@admin.route("/upload/<upload_id>/")
+@admin_login_req
+def upload_status(upload_id):
+    try:
+        data = upload.status(upload_id)
+    except upload.UploadError as e:
+        return json.dumps(dict(ok=0, msg=str(e))), 404
+    data["ok"] = 1
+    return json.dumps(data)
+
+
+# 分块上传：上传一块，请求体为分块内容，X-Chunk-Md5 头为其 md5
+@admin.route("/upload/<upload_id>/<int:index>/", methods=["PUT"])
+@admin_login_req
+def upload_chunk(upload_id, index):
+    try:
+        upload.save_chunk(upload_id, index, request.stream, request.headers.get("X-Chunk-Md5"))
+    except upload.UploadError as e:
+        return json.dumps(dict(ok=0, msg=str(e))), 400
+    return json.dumps(dict(ok=1, index=index))
+
+
+# 分块上传：完成，拼接文件并按电影表单(含封面)创建电影
+@admin.route("/upload/<upload_id>/complete/", methods=["POST"])
+@admin_login_req
+def upload_complete(upload_id):
+    from app.admin.forms import MovieForm
+    form = MovieForm()
+    form.url.validators = []
+    if not form.validate_on_submit():
+        return json.dumps(dict(ok=0, msg=form.errors)), 400
+    data = form.data
+    try:
+        tmp = storage.temp_path()
+        meta, chunks = upload.assemble(upload_id, tmp)
+    except upload.UploadBusy as e:
+        return json.dumps(dict(ok=0, msg=str(e))), 409
+    except upload.UploadError as e:
+        return json.dumps(dict(ok=0, msg=str(e))), 400
+    try:
+        url = storage.put(tmp, os.path.splitext(meta["filename"])[1], digest=meta["sha256"])
+        cover = storage.save(form.cover.data)
+        movie = create_movie(data, url, cover)
+    except Exception:
+        # 分块保留，客户端可以重新完成
+        db.session.rollback()
+        upload.restore(chunks)
+        raise
+    upload.finish(chunks)
+    return json.dumps(dict(ok=1, id=movie.id))
+
+
 # 电影列表
 @admin.route("/movie/list/<int:page>/")
 @admin_login_req
@@ -248,10 +324,19 @@ def movie_list(page=1):
 @admin_login_req
 def movie_del(m_id=None):
     movie = Movie.query.filter_by(id=m_id).first_or_404()
+    unindex_movie(movie)
+    # 文件可能被其他电影/预告共用，最后一个引用释放后才删除
+    url_dead = storage.release(movie.url)
+    cover_dead = storage.release(movie.cover)
     db.session.delete(movie)
     db.session.commit()
-    os.remove(app.config["UP_DIR"] + movie.url)
-    os.remove(app.config["UP_DIR"] + movie.cover)
+    invalidate_movie((movie.tag_id, movie.star))
+    title_index.remove(movie.id)
+    jobs.enqueue("search_compact")
+    if url_dead:
+        jobs.enqueue("unlink", filename=movie.url)
+    if cover_dead:
+        jobs.enqueue("unlink", filename=movie.cover, kind="cover")
     flash("删除电影成功！", "ok")
     return redirect(url_for("admin.movie_list", page=1))
 
@@ -260,6 +345,7 @@ def movie_del(m_id=None):
 @admin.route("/movie/edit/<int:m_id>/", methods=["GET", "POST"])
 @admin_login_req
 def movie_edit(m_id=None):
+    from app.admin.forms import MovieForm
     form = MovieForm()
     form.url.validators = []
     form.cover.validators = []
@@ -272,21 +358,18 @@ def movie_edit(m_id=None):
 
     if form.validate_on_submit():
         data = form.data
-
-        if not os.path.exists(app.config["UP_DIR"]):
-            # 创建一个多级目录
-            os.makedirs(app.config["UP_DIR"])
-            os.chmod(app.config["UP_DIR"], stat.S_IRWXU)
+        old_tag_star = (movie.tag_id, movie.star)
+        old_text = (movie.title, movie.info)
+        old_url, old_cover = movie.url, movie.cover
+        url_dead = cover_dead = False
 
         if form.url.data.filename != "":
-            url_filename = secure_filename(form.url.data.filename)
-            movie.url = change_filename(url_filename)
-            form.url.data.save(app.config["UP_DIR"] + movie.url)
+            movie.url = storage.save(form.url.data)
+            url_dead = storage.release(old_url)
 
         if form.cover.data.filename != "":
-            cover_filename = secure_filename(form.cover.data.filename)
-            movie.cover = change_filename(cover_filename)
-            form.cover.data.save(app.config["UP_DIR"] + movie.cover)
+            movie.cover = storage.save(form.cover.data)
+            cover_dead = storage.release(old_cover)
 
         movie.title = data["title"]
         movie.info = data["info"]
@@ -296,7 +379,19 @@ def movie_edit(m_id=None):
         movie.length = data["length"]
         movie.release_time = data["release_time"]
         db.session.add(movie)
+        index_movie(movie, old=old_text)
         db.session.commit()
+        invalidate_movie(old_tag_star, (movie.tag_id, movie.star))
+        title_index.put(movie)
+        jobs.enqueue("search_compact")
+        if movie.url != old_url:
+            jobs.enqueue("movie_media", movie_id=movie.id)
+        if movie.cover != old_cover:
+            jobs.enqueue("derivatives", filename=movie.cover, kind="cover")
+        if url_dead:
+            jobs.enqueue("unlink", filename=old_url)
+        if cover_dead:
+            jobs.enqueue("unlink", filename=old_cover, kind="cover")
         flash("添加电影成功！", "ok")
         return redirect(url_for("admin.movie_edit", m_id=m_id))
     return render_template("admin/movie_edit.html", form=form, movie=movie)
@@ -306,24 +401,18 @@ def movie_edit(m_id=None):
 @admin.route("/preview/add/", methods=["GET", "POST"])
 @admin_login_req
 def preview_add():
+    from app.admin.forms import PreViewForm
     form = PreViewForm()
     if form.validate_on_submit():
         data = form.data
-        cover_filename = secure_filename(form.cover.data.filename)
-
-        if not os.path.exists(app.config["UP_DIR"]):
-            # 创建一个多级目录
-            os.makedirs(app.config["UP_DIR"])
-            os.chmod(app.config["UP_DIR"], stat.S_IRWXU)
-
-        cover = change_filename(cover_filename)
-        form.cover.data.save(app.config["UP_DIR"] + cover)
+        cover = storage.save(form.cover.data)
         preview = Preview(
             title=data["title"],
             cover=cover
         )
         db.session.add(preview)
         db.session.commit()
+        jobs.enqueue("derivatives", filename=cover, kind="cover")
         flash("添加预告成功！", "ok")
         return redirect(url_for('admin.preview_add'))
     return render_template("admin/preview_add.html", form=form)
@@ -342,9 +431,11 @@ def preview_list(page=1):
 @admin_login_req
 def preview_del(p_id=None):
     preview = Preview.query.filter_by(id=p_id).first_or_404()
+    cover_dead = storage.release(preview.cover)
     db.session.delete(preview)
     db.session.commit()
-    os.remove(app.config["UP_DIR"] + preview.cover)
+    if cover_dead:
+        jobs.enqueue("unlink", filename=preview.cover, kind="cover")
     flash("删除预告成功！", "ok")
     return redirect(url_for("admin.movie_list", page=1))
 
@@ -353,6 +444,7 @@ def preview_del(p_id=None):
 @admin.route("/preview/edit/<int:p_id>/", methods=["GET", "POST"])
 @admin_login_req
 def preview_edit(p_id=None):
+    from app.admin.forms import PreViewForm
     form = PreViewForm()
     form.cover.validators = []
     preview = Preview.query.get_or_404(int(p_id))
@@ -360,15 +452,20 @@ def preview_edit(p_id=None):
         form.title.data = preview.title
     if form.validate_on_submit():
         data = form.data
+        old_cover = preview.cover
+        cover_dead = False
 
         if form.cover.data.filename != "":
-            cover_filename = secure_filename(form.cover.data.filename)
-            preview.cover = change_filename(cover_filename)
-            form.cover.data.save(app.config["UP_DIR"] + preview.cover)
+            preview.cover = storage.save(form.cover.data)
+            cover_dead = storage.release(old_cover)
 
         preview.title = data["title"]
         db.session.add(preview)
         db.session.commit()
+        if preview.cover != old_cover:
+            jobs.enqueue("derivatives", filename=preview.cover, kind="cover")
+        if cover_dead:
+            jobs.enqueue("unlink", filename=old_cover, kind="cover")
         flash("修改预告成功！", "ok")
         return redirect(url_for('admin.preview_edit', p_id=p_id))
     return render_template("admin/preview_edit.html", form=form, preview=preview)
@@ -395,8 +492,11 @@ def user_view(u_id=None):
 @admin_login_req
 def user_del(u_id=None):
     user = User.query.get_or_404(int(u_id))
+    avatar_dead = storage.release(user.avatar, "USER_DIR")
     db.session.delete(user)
     db.session.commit()
+    if avatar_dead:
+        jobs.enqueue("unlink", filename=user.avatar, root="USER_DIR", kind="avatar")
     flash("删除会员成功！", "ok")
     return redirect(url_for("admin.user_list", page=1))
 
@@ -461,27 +561,37 @@ def moviecol_del(m_id=None):
 @admin.route("/oplog/list/<int:page>/")
 @admin_login_req
 def oplog_list(page=1):
-    page_data = OpLog.query.join(
-        Admin
-    ).filter(
-        Admin.id == OpLog.admin_id
-    ).order_by(
-        OpLog.addtime.desc()
-    ).paginate(page=page, per_page=10)
+    page_data = log_page(OpLog, cursor=request.args.get("cursor", ""), per_page=10)
     return render_template("admin/oplog_list.html", page_data=page_data)
 
 
+# 后台任务列表
+@admin.route("/job/list/<int:page>/")
+@admin_login_req
+def job_list(page=1):
+    items, total = jobs.recent(page=page, per_page=10)
+    page_data = Pagination(None, page, 10, total, items)
+    return render_template("admin/job_list.html", page_data=page_data)
+
+
+# 后台任务状态
+@admin.route("/job/<int:job_id>/")
+@admin_login_req
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return json.dumps(dict(ok=0, msg="任务不存在！")), 404
+    return json.dumps(dict(
+        ok=1, id=job.id, task=job.task, status=job.status, error=job.error,
+        addtime=job.addtime, starttime=job.starttime, endtime=job.endtime
+    ))
+
+
 # 管理员登录日志
 @admin.route("/adminloginlog/list/<int:page>/")
 @admin_login_req
 def adminloginlog_list(page=1):
-    page_data = AdminLog.query.join(
-        Admin
-    ).filter(
-        Admin.id == AdminLog.admin_id
-    ).order_by(
-        AdminLog.addtime.desc()
-    ).paginate(page=page, per_page=10)
+    page_data = log_page(AdminLog, cursor=request.args.get("cursor", ""), per_page=10)
     return render_template("admin/adminloginlog_list.html", page_data=page_data)
 
 
@@ -489,29 +599,45 @@ def adminloginlog_list(page=1):
 @admin.route("/userloginlog/list/<int:page>/")
 @admin_login_req
 def userloginlog_list(page=1):
-    page_data = UserLog.query.join(
-        User
-    ).filter(
-        User.id == UserLog.user_id
-    ).order_by(
-        UserLog.addtime.desc()
-    ).paginate(page=page, per_page=10)
+    page_data = log_page(UserLog, cursor=request.args.get("cursor", ""), per_page=10)
     return render_template("admin/userloginlog_list.html", page_data=page_data)
 
 
+# 导出会员/评论/收藏/日志，边查询边输出
+@admin.route("/export/<kind>/<fmt>/")
+@admin_login_req
+def export(kind, fmt):
+    from app.export import EXPORTS, csv_stream, ndjson_stream
+    formats = {
+        "csv": (csv_stream, "text/csv; charset=utf-8"),
+        "ndjson": (ndjson_stream, "application/x-ndjson; charset=utf-8"),
+    }
+    if kind not in EXPORTS or fmt not in formats:
+        abort(404)
+    stream, content_type = formats[fmt]
+    filename = "{}-{}.{}".format(kind, datetime.datetime.now().strftime("%Y%m%d%H%M%S"), fmt)
+    return Response(stream_with_context(stream(kind)), content_type=content_type, headers={
+        "Content-Disposition": "attachment; filename={}".format(filename),
+        # 不让 nginx 缓冲整个响应
+        "X-Accel-Buffering": "no",
+    })
+
+
 # 添加角色
 @admin.route("/role/add/", methods=["GET", "POST"])
 @admin_login_req
 def role_add():
+    from app.admin.forms import RoleForm
     form = RoleForm()
     if form.validate_on_submit():
         data = form.data
         role = Role(
             name=data["name"],
-            auths=",".join(str(i) for i in data["auths"])
+            auths=Auth.query.filter(Auth.id.in_(data["auths"])).all()
         )
         db.session.add(role)
         db.session.commit()
+        invalidate_choices("role")
         flash("添加角色成功！", "ok")
     return render_template("admin/role_add.html", form=form)
 
@@ -533,6 +659,8 @@ def role_del(r_id=None):
     role = Role.query.get_or_404(int(r_id))
     db.session.delete(role)
     db.session.commit()
+    invalidate_role(int(r_id))
+    invalidate_choices("role")
     flash("删除角色成功！", "ok")
     return redirect(url_for("admin.role_list", page=1))
 
@@ -541,18 +669,21 @@ def role_del(r_id=None):
 @admin.route("/role/edit/<int:r_id>/", methods=["GET", "POST"])
 @admin_login_req
 def role_edit(r_id=None):
+    from app.admin.forms import RoleForm
     form = RoleForm()
     role = Role.query.get_or_404(int(r_id))
 
     if request.method == "GET":
-        form.auths.data = list(int(i) for i in role.auths.split(","))
+        form.auths.data = [v.id for v in role.auths]
 
     if form.validate_on_submit():
         data = form.data
         role.name = data["name"]
-        role.auths = ",".join(str(i) for i in data["auths"])
+        role.auths = Auth.query.filter(Auth.id.in_(data["auths"])).all()
         db.session.add(role)
         db.session.commit()
+        invalidate_role(int(r_id))
+        invalidate_choices("role")
         flash("修改角色成功！", "ok")
         return redirect(url_for("admin.role_edit", r_id=r_id))
     return render_template("admin/role_edit.html", form=form, role=role)
@@ -562,6 +693,7 @@ def role_edit(r_id=None):
 @admin.route("/auth/add/", methods=["GET", "POST"])
 @admin_login_req
 def auth_add():
+    from app.admin.forms import AuthForm
     form = AuthForm()
     if form.validate_on_submit():
         data = form.data
@@ -571,6 +703,8 @@ def auth_add():
         )
         db.session.add(auth)
         db.session.commit()
+        invalidate_rules()
+        invalidate_choices("auth")
         flash("添加权限成功！", "ok")
     return render_template("admin/auth_add.html", form=form)
 
@@ -592,6 +726,8 @@ def auth_del(a_id=None):
     auth = Auth.query.filter_by(id=a_id).first_or_404()
     db.session.delete(auth)
     db.session.commit()
+    invalidate_rules()
+    invalidate_choices("auth")
     flash("删除权限成功！", "ok")
     return redirect(url_for("admin.auth_list", page=1))
 
@@ -600,6 +736,7 @@ def auth_del(a_id=None):
 @admin.route("/auth/edit/<int:a_id>/", methods=["GET", "POST"])
 @admin_login_req
 def auth_edit(a_id=None):
+    from app.admin.forms import AuthForm
     form = AuthForm()
     auth = Auth.query.get_or_404(int(a_id))
     if form.validate_on_submit():
@@ -608,6 +745,8 @@ def auth_edit(a_id=None):
         auth.name = data["name"]
         db.session.add(auth)
         db.session.commit()
+        invalidate_rules()
+        invalidate_choices("auth")
         flash("修改权限成功！", "ok")
         return redirect(url_for("admin.auth_edit", a_id=a_id))
     return render_template("admin/auth_edit.html", form=form, auth=auth)
@@ -617,6 +756,7 @@ def auth_edit(a_id=None):
 @admin.route("/admin/add/", methods=["GET", "POST"])
 @admin_login_req
 def admin_add():
+    from app.admin.forms import AdminForm
     form = AdminForm()
     if form.validate_on_submit():
         from werkzeug.security import generate_password_hash
@@ -0,0 +1,109 @@
+import os
+import threading
+
+
+class BufferedWriter(object):
+    """
+    写缓冲基类：请求中只把数据放入内存，由后台线程每隔 interval 秒（或缓冲超过 size 条时）
+    调用 _write 批量写入数据库。写入失败时放回缓冲，超过 limit 条时由 _trim 丢弃一部分并记录日志，
+    数据库长时间不可用时内存不会无限增长。
+    子类实现 _empty、_put、_merge、_trim 和 _write，配置项为 <config_prefix>_FLUSH_INTERVAL、
+    <config_prefix>_FLUSH_SIZE 和 <config_prefix>_BUFFER_LIMIT
+    """
+
+    name = "buffered-writer"
+    config_prefix = None
+
+    def __init__(self, interval=5, size=1000, limit=100000):
+        self.interval = interval
+        self.size = size
+        self.limit = limit
+        self._pending = self._empty()
+        self._lock = threading.Lock()
+        # 同一时间只有一次 flush；进程退出时的 flush 会等后台线程正在写入的一批完成（或失败放回）后再写剩余的
+        self._flush_lock = threading.Lock()
+        self._pid = None
+        self._wakeup = threading.Event()
+        self.app = None
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get(self.config_prefix + "_FLUSH_INTERVAL", self.interval)
+        self.size = app.config.get(self.config_prefix + "_FLUSH_SIZE", self.size)
+        self.limit = app.config.get(self.config_prefix + "_BUFFER_LIMIT", self.limit)
+
+    def _empty(self):
+        raise NotImplementedError
+
+    def _put(self, pending, *args, **kwargs):
+        """
+        把一条数据放入缓冲
+        """
+        raise NotImplementedError
+
+    def _merge(self, older, newer):
+        """
+        写入失败时把取出的缓冲与之后新放入的合并，返回合并后的缓冲
+        """
+        raise NotImplementedError
+
+    def _trim(self, pending, limit):
+        """
+        缓冲超过上限时调用，返回只保留 limit 条的缓冲
+        """
+        raise NotImplementedError
+
+    def _write(self, pending):
+        """
+        在应用上下文中写入一批数据，失败时抛出异常
+        """
+        raise NotImplementedError
+
+    def _start(self):
+        # 每个(fork 出来的)进程各自启动一个刷新线程
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        # fork 时父进程的刷新线程可能正持有这把锁
+        self._flush_lock = threading.Lock()
+        t = threading.Thread(target=self._run, name=self.name)
+        t.daemon = True
+        t.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _add(self, *args, **kwargs):
+        with self._lock:
+            self._start()
+            self._put(self._pending, *args, **kwargs)
+            full = len(self._pending) >= self.size
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        if self.app is None:
+            return
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, self._empty()
+        if not pending:
+            return
+        try:
+            with self.app.app_context():
+                self._write(pending)
+        except Exception:
+            self.app.logger.exception("%s: flush failed", self.name)
+            with self._lock:
+                self._pending = self._merge(pending, self._pending)
+                dropped = len(self._pending) - self.limit
+                if dropped > 0:
+                    self._pending = self._trim(self._pending, self.limit)
+            if dropped > 0:
+                self.app.logger.error("%s: buffer full, dropped %d entries", self.name, dropped)
@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import CacheVersion
+
+
+class LRUCache(object):
+    """
+    进程内 LRU 缓存，条目超过 ttl 秒后失效，超过 maxsize 时淘汰最久未使用的条目
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expire, value = entry
+            if expire < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate):
+        """
+        删除 predicate(key) 为真的条目
+        """
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# 最近读取的版本号: 名称 -> 版本号，只在进程内保留很短的时间
+versions_cache = LRUCache(maxsize=4096, ttl=1)
+
+
+def init_app(app):
+    versions_cache.ttl = app.config.get("VERSION_CHECK_INTERVAL", 1)
+
+
+def shared_versions(*names):
+    """
+    读取多个进程共用的缓存版本号，返回 {名称: 版本号}，没有记录的为 0
+    """
+    versions = dict((name, 0) for name in names)
+    versions.update(db.session.query(CacheVersion.name, CacheVersion.version).filter(
+        CacheVersion.name.in_(names)
+    ))
+    return versions
+
+
+def recent_versions(*names):
+    """
+    同 shared_versions，但结果在进程内保留 VERSION_CHECK_INTERVAL 秒，缺少的名称一次查询取回；
+    其他进程的改动最多晚这么久生效，用于可以容忍短暂过期的页面缓存
+    """
+    versions = dict((name, versions_cache.get(name)) for name in names)
+    missing = [name for name, version in versions.items() if version is None]
+    if missing:
+        for name, version in shared_versions(*missing).items():
+            versions_cache.set(name, version)
+            versions[name] = version
+    return versions
+
+
+def bump_versions(*names):
+    """
+    数据变化后调用，把这些缓存的版本号加一，所有进程中的旧条目随即失效
+    """
+    table = CacheVersion.__table__
+    for name in sorted(set(names)):
+        update = table.update().where(table.c.name == name).values(version=table.c.version + 1)
+        with db.engine.begin() as conn:
+            if conn.execute(update).rowcount:
+                continue
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.insert().values(name=name, version=1))
+        except IntegrityError:
+            # 另一个进程同时插入了第一条
+            with db.engine.begin() as conn:
+                conn.execute(update)
+    # 本进程的改动立即生效
+    versions_cache.invalidate(lambda key: key in names)
@@ -0,0 +1,138 @@
+from collections import namedtuple
+
+from flask_sqlalchemy import Pagination
+
+from app.cache import LRUCache, bump_versions, recent_versions
+from app.models import Movie, Tag
+from app.pagination import KeysetPage, keyset_paginate
+
+CachedTag = namedtuple("CachedTag", ["id", "name"])
+# 列表页用到的电影字段
+CachedMovie = namedtuple("CachedMovie", ["id", "title", "cover", "star"])
+
+# 首页列表缓存，存列表页要显示的电影字段与总数/游标，命中时不访问数据库；
+# 键中带有该筛选条件在 cacheVersion 中的版本号（进程内每 VERSION_CHECK_INTERVAL 秒读取一次），
+# 任一进程改动电影后其他进程的旧条目也不再被读取
+catalog_cache = LRUCache()
+
+# 星级取值，删除标签时清除该标签下各星级的列表
+STARS = range(1, 6)
+
+
+def init_app(app):
+    catalog_cache.maxsize = app.config.get("CATALOG_CACHE_SIZE", 1024)
+    catalog_cache.ttl = app.config.get("CATALOG_CACHE_TTL", 60)
+
+
+# 片长筛选档位(分钟): 编号 -> [下限, 上限)，档位存于 movie.duration_level，按等值筛选才能走复合索引
+DURATIONS = {
+    1: (0, 60),
+    2: (60, 90),
+    3: (90, 120),
+    4: (120, None),
+}
+
+
+def duration_level(duration):
+    """
+    时长(秒)所在的片长档位，未知时为 0
+    """
+    if duration is None:
+        return 0
+    for level, (low, high) in DURATIONS.items():
+        if duration >= low * 60 and (high is None or duration < high * 60):
+            return level
+    return 0
+
+
+# 首页电影列表的筛选条件
+def movie_query(tid=0, star=0, dur=0):
+    movie = Movie.query
+    if int(tid) != 0:
+        movie = movie.filter_by(tag_id=int(tid))
+    if int(star) != 0:
+        movie = movie.filter_by(star=int(star))
+    if int(dur) in DURATIONS:
+        movie = movie.filter_by(duration_level=int(dur))
+    return movie
+
+
+# 首页电影列表的排序键，1 为降序，2 为升序，id 作为最终判定且方向与主排序键一致
+def movie_order(time=0, pm=0, cm=0):
+    order = []
+    if int(time) != 0:
+        order.append((Movie.addtime, int(time) == 1))
+    if int(pm) != 0:
+        order.append((Movie.play_num, int(pm) == 1))
+    if int(cm) != 0:
+        order.append((Movie.comment_num, int(cm) == 1))
+    order.append((Movie.id, order[0][1] if order else False))
+    return order
+
+
+# 首页电影列表，带缓存
+def catalog_page(tid=0, star=0, time=0, pm=0, cm=0, page=1, cursor="", per_page=10, dur=0):
+    tid, star, dur, time, pm, cm = int(tid), int(star), int(dur), int(time), int(pm), int(cm)
+    # 游标模式下 page 不参与查询
+    use_cursor = bool(cursor) or page == 1
+    name = _list_version(tid, star)
+    # 与标签列表的版本号一起读取，首页只需一次查询
+    version = recent_versions(name, "catalog:tags")[name]
+    key = ("page", version, tid, star, dur, time, pm, cm, 1 if use_cursor else page, cursor or "")
+
+    cached = catalog_cache.get(key)
+    if cached is not None:
+        items, extra = cached
+        if use_cursor:
+            return KeysetPage(items, *extra)
+        return Pagination(None, page, per_page, extra, items)
+
+    movie = movie_query(tid, star, dur)
+    order = movie_order(time, pm, cm)
+    if use_cursor:
+        page_data = keyset_paginate(movie, order, cursor=cursor, per_page=per_page)
+        extra = (page_data.next_cursor, page_data.prev_cursor)
+    else:
+        # 兼容旧的按页码访问
+        page_data = movie.order_by(
+            *[col.desc() if desc else col.asc() for col, desc in order]
+        ).paginate(page=page, per_page=per_page)
+        extra = page_data.total
+    catalog_cache.set(key, ([CachedMovie(m.id, m.title, m.cover, m.star) for m in page_data.items], extra))
+    return page_data
+
+
+# 标签列表，带缓存
+def catalog_tags():
+    key = ("tags", recent_versions("catalog:tags")["catalog:tags"])
+    tags = catalog_cache.get(key)
+    if tags is None:
+        tags = [CachedTag(t.id, t.name) for t in Tag.query.all()]
+        catalog_cache.set(key, tags)
+    return tags
+
+
+def _list_version(tid, star):
+    # 每种 标签 × 星级 筛选一个版本号，0 表示不筛选
+    return "catalog:{}:{}".format(int(tid or 0), int(star or 0))
+
+
+def invalidate_movie(*tag_stars):
+    """
+    电影增删改后调用，参数为受影响的 (tag_id, star)，只清除可能包含这部电影的列表
+    """
+    names = set()
+    for tag_id, star in tag_stars:
+        t, s = int(tag_id or 0), int(star or 0)
+        names.update(_list_version(a, b) for a in set([0, t]) for b in set([0, s]))
+    bump_versions(*names)
+
+
+def invalidate_tag(tag_id=None):
+    """
+    标签增删改后调用，标签删除时同时清除该标签下的列表
+    """
+    names = ["catalog:tags"]
+    if tag_id is not None:
+        names += [_list_version(tag_id, s) for s in [0] + list(STARS)]
+    bump_versions(*names)
@@ -0,0 +1,49 @@
+from app.cache import LRUCache, bump_versions, shared_versions
+from app.models import Auth, Role, Tag
+
+# 下拉选项缓存，键为 (名称, 版本号)，版本号存于 cacheVersion，
+# 任一进程中数据变化后所有进程的旧版本条目都不再被读取，到期后淘汰
+choices_cache = LRUCache()
+
+
+def init_app(app):
+    choices_cache.maxsize = app.config.get("CHOICES_CACHE_SIZE", 64)
+    choices_cache.ttl = app.config.get("CHOICES_CACHE_TTL", 60)
+
+
+class LazyChoices(object):
+    """
+    SelectField 的选项，表单绑定字段时才查询，按版本号缓存
+    """
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+
+    def load(self):
+        name = "choices:" + self.name
+        key = (self.name, shared_versions(name)[name])
+        choices = choices_cache.get(key)
+        if choices is None:
+            choices = [
+                (v.id, v.name) for v in self.model.query.with_entities(
+                    self.model.id, self.model.name
+                ).order_by(self.model.id)
+            ]
+            choices_cache.set(key, choices)
+        return choices
+
+    def __iter__(self):
+        return iter(self.load())
+
+
+tag_choices = LazyChoices("tag", Tag)
+auth_choices = LazyChoices("auth", Auth)
+role_choices = LazyChoices("role", Role)
+
+
+def invalidate_choices(name):
+    """
+    标签/权限/角色增删改后调用，name 为 tag、auth 或 role
+    """
+    bump_versions("choices:" + name)
@@ -0,0 +1,58 @@
+import atexit
+from collections import Counter
+
+from sqlalchemy import bindparam
+
+from app import db
+from app.buffer import BufferedWriter
+from app.models import Movie
+
+
+class PlayCounter(BufferedWriter):
+    """
+    播放量写缓冲：请求中只在内存里累加，由后台线程每隔 interval 秒
+    （或累计超过 size 部电影时）批量执行 UPDATE movie SET play_num = play_num + n
+    """
+
+    name = "play-counter"
+    config_prefix = "PLAY"
+
+    def _empty(self):
+        return Counter()
+
+    def _put(self, pending, movie_id, n=1):
+        pending[movie_id] += n
+
+    def _merge(self, older, newer):
+        older.update(newer)
+        return older
+
+    def _trim(self, pending, limit):
+        # 保留次数最多的电影
+        return Counter(dict(pending.most_common(limit)))
+
+    def _write(self, pending):
+        stmt = Movie.__table__.update().where(
+            Movie.id == bindparam("m_id")
+        ).values(
+            play_num=Movie.play_num + bindparam("n")
+        )
+        with db.engine.begin() as conn:
+            conn.execute(stmt, [dict(m_id=k, n=v) for k, v in pending.items()])
+
+    def incr(self, movie_id, n=1):
+        self._add(movie_id, n)
+
+    def pending(self, movie_id):
+        """
+        尚未写入数据库的播放次数
+        """
+        return self._pending.get(movie_id, 0)
+
+
+play_counter = PlayCounter()
+atexit.register(play_counter.flush)
+
+
+def init_app(app):
+    play_counter.init_app(app)
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+
+from app import db
+from app.models import AdminLog, Comment, Movie, MovieCol, OpLog, User, UserLog
+from app.partitions import PARTITIONED, partition_months, partition_table
+
+# 每批从游标读取并写出的行数
+BATCH_SIZE = 1000
+
+
+def _users():
+    return [db.session.query(
+        User.id, User.name, User.email, User.phone, User.info, User.addtime
+    ).order_by(User.id)]
+
+
+def _comments():
+    return [db.session.query(
+        Comment.id, Comment.content, Movie.title, User.name, Comment.addtime
+    ).outerjoin(Movie, Movie.id == Comment.movie_id).outerjoin(
+        User, User.id == Comment.user_id
+    ).order_by(Comment.id)]
+
+
+def _moviecols():
+    return [db.session.query(
+        MovieCol.id, Movie.title, User.name, MovieCol.addtime
+    ).outerjoin(Movie, Movie.id == MovieCol.movie_id).outerjoin(
+        User, User.id == MovieCol.user_id
+    ).order_by(MovieCol.id)]
+
+
+def _logs(model, columns):
+    """
+    日志按月分表，从新到旧逐个分表导出
+    """
+
+    def queries():
+        owner, owner_model, _ = PARTITIONED[model]
+        result = []
+        for month in partition_months(model, shared=True):
+            table = partition_table(model, month)
+            result.append(db.session.query(
+                *[owner_model.name if c == owner else table.c[c] for c in columns]
+            ).select_from(table).outerjoin(
+                owner_model, owner_model.id == table.c[owner]
+            ).order_by(table.c.addtime.desc(), table.c.id.desc()))
+        return result
+
+    return queries
+
+
+# 可导出的数据: 名称 -> ([(NDJSON 字段名, CSV 表头)], 返回查询列表的函数)
+EXPORTS = {
+    "user": ([("id", "编号"), ("name", "昵称"), ("email", "邮箱"), ("phone", "手机号"), ("info", "简介"),
+              ("addtime", "注册时间")], _users),
+    "comment": ([("id", "编号"), ("content", "内容"), ("movie", "电影"), ("user", "会员"),
+                 ("addtime", "添加时间")], _comments),
+    "moviecol": ([("id", "编号"), ("movie", "电影"), ("user", "会员"), ("addtime", "添加时间")], _moviecols),
+    "userlog": ([("id", "编号"), ("user", "会员"), ("ip", "登录IP"), ("addtime", "登录时间")],
+                _logs(UserLog, ["id", "user_id", "ip", "addtime"])),
+    "adminlog": ([("id", "编号"), ("admin", "管理员"), ("ip", "登录IP"), ("addtime", "登录时间")],
+                 _logs(AdminLog, ["id", "admin_id", "ip", "addtime"])),
+    "oplog": ([("id", "编号"), ("admin", "管理员"), ("reason", "操作原因"), ("ip", "操作IP"),
+               ("addtime", "操作时间")], _logs(OpLog, ["id", "admin_id", "reason", "ip", "addtime"])),
+}
+
+
+def _batches(kind, batch):
+    """
+    逐批返回行元组：只查询列，不创建模型对象，会话的对象映射不随行数增长；
+    yield_per 使用服务端游标（MySQL 为 SSCursor），内存中最多保留一批
+    """
+    rows = []
+    for query in EXPORTS[kind][1]():
+        for row in query.yield_per(batch):
+            rows.append(row)
+            if len(rows) >= batch:
+                yield rows
+                rows = []
+    if rows:
+        yield rows
+
+
+def _csv_cell(value):
+    # 以这些字符开头的单元格会被 Excel 当作公式执行，前面加单引号按文本显示
+    if isinstance(value, str) and value.startswith(("=", "+", "-", "@", "\t", "\r")):
+        return "'" + value
+    return value
+
+
+def csv_stream(kind, batch=BATCH_SIZE):
+    """
+    逐批生成 CSV 文本，带 BOM 以便 Excel 识别 UTF-8
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write("\ufeff")
+    writer.writerow([header for _, header in EXPORTS[kind][0]])
+    for rows in _batches(kind, batch):
+        writer.writerows([_csv_cell(v) for v in row] for row in rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+def ndjson_stream(kind, batch=BATCH_SIZE):
+    """
+    逐批生成 NDJSON 文本，每行一个对象，时间转为字符串
+    """
+    fields = [field for field, _ in EXPORTS[kind][0]]
+    for rows in _batches(kind, batch):
+        yield "".join(
+            json.dumps(dict(zip(fields, row)), ensure_ascii=False, default=str) + "\n" for row in rows
+        )
@@ -1,17 +1,20 @@
-import datetime
 import json
-import os
-import stat
 from functools import wraps
 
-from werkzeug.utils import secure_filename
-
 from . import home
-from flask import render_template, redirect, url_for, flash, session, request
-from app.home.forms import RegisterForm, LoginForm, UserForm, PwdForm, CommentForm
-from werkzeug.security import generate_password_hash
-from app import db, app
+# 表单和导出在用到的视图函数中才导入，启动时不加载 wtforms/csv
+from flask import render_template, redirect, url_for, flash, session, request, abort, current_app
+from werkzeug.security import generate_password_hash, safe_join
+from app import db
 from app.models import User, UserLog, Preview, Tag, Movie, Comment, MovieCol
+from app.catalog import catalog_page, catalog_tags
+from app.search import search_movies
+from app.suggest import title_index
+from app.counter import play_counter
+from app.logwriter import log_writer
+from app.partitions import log_page
+from app.stream import send_media
+from app import jobs, storage
 import uuid
 
 
@@ -27,15 +30,9 @@ def user_login_req(f):
     return decorator
 
 
-# 修改文件名称
-def change_filename(filename):
-    file_info = os.path.splitext(filename)
-    filename = datetime.datetime.now().strftime("%Y%m%d%H%M%S") + str(uuid.uuid4().hex) + file_info[1]
-    return filename
-
-
 @home.route("/login/", methods=["GET", "POST"])
 def login():
+    from app.home.forms import LoginForm
     form = LoginForm()
     if form.validate_on_submit():
         data = form.data
@@ -48,12 +45,11 @@ def login():
             return redirect(url_for('home.login'))
         session["user"] = u.name
         session["user_id"] = u.id
-        user_log = UserLog(
+        log_writer.add(
+            UserLog,
             user_id=u.id,
             ip=request.remote_addr
         )
-        db.session.add(user_log)
-        db.session.commit()
 
         next_w = request.args.get("next")
         if not next_w or not next_w.startswith('/'):
@@ -72,6 +68,7 @@ def logout():
 
 @home.route("/register/", methods=["GET", "POST"])
 def register():
+    from app.home.forms import RegisterForm
     form = RegisterForm()
     if form.validate_on_submit():
         data = form.data
@@ -91,6 +88,7 @@ def register():
 @home.route("/user/", methods=["GET", "POST"])
 @user_login_req
 def user():
+    from app.home.forms import UserForm
     form = UserForm()
     c_user = User.query.get(session["user_id"])
     form.avatar.validators = []
@@ -101,14 +99,6 @@ def user():
         form.info.data = c_user.info
     if form.validate_on_submit():
         data = form.data
-        avatar_filename = secure_filename(form.avatar.data.filename)
-
-        if not os.path.exists(app.config["USER_DIR"]):
-            os.makedirs(app.config["USER_DIR"])
-            os.chmod(app.config["USER_DIR"], stat.S_IRWXU)
-
-        avatar = change_filename(avatar_filename)
-        form.avatar.data.save(app.config["USER_DIR"] + avatar)
 
         name_cnt = User.query.filter_by(name=data["name"]).count()
         if name_cnt == 1 and data["name"] != c_user.name:
@@ -125,6 +115,13 @@ def user():
             flash("手机已存在！", "err")
             return redirect(url_for('home.user'))
 
+        # 校验通过后才保存头像，避免重定向时留下没有引用的文件
+        avatar = old_avatar = c_user.avatar
+        avatar_dead = False
+        if form.avatar.data.filename != "":
+            avatar = storage.save(form.avatar.data, "USER_DIR")
+            avatar_dead = storage.release(c_user.avatar, "USER_DIR")
+
         c_user.name = data["name"],
         c_user.email = data["email"],
         c_user.phone = data["phone"],
@@ -133,6 +130,10 @@ def user():
 
         db.session.add(c_user)
         db.session.commit()
+        if avatar != old_avatar:
+            jobs.enqueue("derivatives", filename=avatar, kind="avatar")
+        if avatar_dead:
+            jobs.enqueue("unlink", filename=old_avatar, root="USER_DIR", kind="avatar")
         flash("修改成功！", "ok")
         return redirect(url_for('home.user'))
     return render_template("home/user.html", form=form, user=c_user)
@@ -141,6 +142,7 @@ def user():
 @home.route("/pwd/", methods=["GET", "POST"])
 @user_login_req
 def pwd():
+    from app.home.forms import PwdForm
     form = PwdForm()
     if form.validate_on_submit():
         data = form.data
@@ -174,11 +176,9 @@ def comments(page=1):
 @home.route("/loginlog/<int:page>/")
 @user_login_req
 def loginlog(page=1):
-    page_data = UserLog.query.filter_by(
-        user_id=int(session["user_id"])
-    ).order_by(
-        UserLog.addtime.desc()
-    ).paginate(page=page, per_page=10)
+    page_data = log_page(
+        UserLog, cursor=request.args.get("cursor", ""), per_page=10, owner_id=int(session["user_id"])
+    )
     return render_template("home/loginlog.html", page_data=page_data)
 
 
@@ -225,42 +225,20 @@ def moviecol(page=1):
 # 首页
 @home.route("/<int:page>/")
 def index(page=1):
-    tags = Tag.query.all()
-    movie = Movie.query
-
     tid = request.args.get("tid", 0)
-    if int(tid) != 0:
-        movie = movie.filter_by(tag_id=int(tid))
-
     star = request.args.get("star", 0)
-    if int(star) != 0:
-        movie = movie.filter_by(star=int(star))
-
+    dur = request.args.get("dur", 0)
     time = request.args.get("time", 0)
-    if int(time) != 0:
-        if int(time) == 1:
-            movie = movie.order_by(Movie.addtime.desc())
-        else:
-            movie = movie.order_by(Movie.addtime.asc())
-
     pm = request.args.get("pm", 0)
-    if int(pm) != 0:
-        if int(pm) == 1:
-            movie = movie.order_by(Movie.play_num.desc())
-        else:
-            movie = movie.order_by(Movie.play_num.asc())
-
     cm = request.args.get("cm", 0)
-    if int(cm) != 0:
-        if int(cm) == 1:
-            movie = movie.order_by(Movie.comment_num.desc())
-        else:
-            movie = movie.order_by(Movie.comment_num.asc())
-
-    page_data = movie.paginate(page=page, per_page=10)
+    cursor = request.args.get("cursor", "")
+    page_data = catalog_page(tid, star, time, pm, cm, page=page, cursor=cursor, per_page=10, dur=dur)
+    # 在列表之后读取，复用列表已取回的标签版本号
+    tags = catalog_tags()
     p = {
         "tid": tid,
         "star": star,
+        "dur": dur,
         "time": time,
         "pm": pm,
         "cm": cm
@@ -280,20 +258,20 @@ def animation():
 @home.route("/search/<int:page>/")
 def search(page=1):
     key = request.args.get("key", "")
-
-    movie_cnt = Movie.query.filter(
-        Movie.title.like("%" + key + "%")
-    ).count()
-
-    page_data = Movie.query.filter(
-        Movie.title.like("%" + key + "%")
-    ).order_by(
-        Movie.addtime.desc()
-    ).paginate(page=page, per_page=10)
+    page_data = search_movies(key, page=page, per_page=10)
+    movie_cnt = page_data.total
     page_data.key = key
     return render_template("home/search.html", key=key, page_data=page_data, movie_cnt=movie_cnt)
 
 
+# 片名补全
+@home.route("/suggest/")
+def suggest():
+    key = request.args.get("key", "")
+    data = [dict(id=m_id, title=title) for m_id, title in title_index.complete(key)]
+    return json.dumps(data)
+
+
 @home.route("/play/<int:id>/<int:page>/", methods=["GET", "POST"])
 def play(id=None, page=1):
     movie = Movie.query.join(
@@ -302,7 +280,7 @@ def play(id=None, page=1):
         Tag.id == Movie.tag_id,
         Movie.id == int(id)
     ).first_or_404()
-    movie.play_num += 1
+    play_counter.incr(movie.id)
 
     page_data = Comment.query.join(
         Movie
@@ -315,6 +293,8 @@ def play(id=None, page=1):
         Comment.addtime.desc()
     ).paginate(page=page, per_page=10)
 
+    from app.home.forms import CommentForm
+
     form = CommentForm()
     if "user" in session and form.validate_on_submit():
         data = form.data
@@ -329,6 +309,14 @@ def play(id=None, page=1):
         flash("添加评论成功！", "ok")
         return redirect(url_for('home.play', id=movie.id, page=1))
 
-    db.session.add(movie)
-    db.session.commit()
-    return render_template("home/play.html", movie=movie, form=form, page_data=page_data)
+    play_num = movie.play_num + play_counter.pending(movie.id)
+    return render_template("home/play.html", movie=movie, form=form, page_data=page_data, play_num=play_num)
+
+
+# 电影文件，支持断点/拖动播放
+@home.route("/media/<path:filename>", methods=["GET", "HEAD"])
+def media(filename):
+    path = safe_join(current_app.config["UP_DIR"], filename)
+    if path is None:
+        abort(404)
+    return send_media(path)
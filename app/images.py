@@ -0,0 +1,155 @@
+import os
+
+from flask import current_app, url_for
+
+from app import db
+from app.cache import LRUCache
+from app.models import Blob
+
+
+# 各类图片的缩略图尺寸: 类别 -> (上传目录配置项, [(宽, 高)])
+# 高为 None 时按宽等比缩放，否则居中裁剪为固定尺寸
+KINDS = {
+    "cover": ("UP_DIR", [(262, None), (524, None), (1024, None)]),
+    "avatar": ("USER_DIR", [(50, 50), (100, 100)]),
+}
+
+# 图片是否已生成缩略图: (上传目录配置项, 文件名) -> bool，由 blob.thumbs 读取
+thumbs_cache = LRUCache()
+
+
+def init_app(app):
+    thumbs_cache.maxsize = app.config.get("THUMBS_CACHE_SIZE", 4096)
+    thumbs_cache.ttl = app.config.get("THUMBS_CACHE_TTL", 60)
+    app.add_template_global(img_srcset)
+    app.add_template_global(img_url)
+
+
+def static_prefix(root):
+    """
+    上传目录在 static 下的路径，如 UP_DIR 为 app/static/uploads/ 时为 "uploads/"
+    """
+    path = os.path.relpath(current_app.config[root], current_app.static_folder)
+    return path.replace(os.sep, "/").rstrip("/") + "/"
+
+
+def derivative_name(filename, size, ext=None):
+    stem, orig_ext = os.path.splitext(filename)
+    return "{}_{}{}".format(stem, size[0], ext or orig_ext.lower())
+
+
+def _pil():
+    """
+    Pillow 在第一次生成缩略图时才导入，启动时不加载；未安装时返回 (None, None)，页面使用原图
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None, None
+    return Image, ImageOps
+
+
+def _render(path, kind):
+    Image, ImageOps = _pil()
+    _, sizes = KINDS[kind]
+    directory, filename = os.path.split(path)
+    with Image.open(path) as im:
+        im.load()
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+        for size in sizes:
+            if size[1] is None:
+                if im.width <= size[0]:
+                    thumb = im.copy()
+                else:
+                    thumb = im.resize((size[0], max(1, im.height * size[0] // im.width)), Image.LANCZOS)
+            else:
+                thumb = ImageOps.fit(im, size, Image.LANCZOS)
+            original = os.path.join(directory, derivative_name(filename, size))
+            if original.endswith((".jpg", ".jpeg")) and thumb.mode == "RGBA":
+                thumb.convert("RGB").save(original, quality=85, optimize=True)
+            else:
+                thumb.save(original, optimize=True)
+            thumb.save(os.path.join(directory, derivative_name(filename, size, ".webp")), "WEBP", quality=80)
+
+
+def mark_derivatives(filename, kind):
+    """
+    在 blob 中记录该图片的缩略图已全部生成，在调用方的事务中执行
+    """
+    root = KINDS[kind][0]
+    table = Blob.__table__
+    db.session.execute(table.update().where(
+        (table.c.root == root) & (table.c.name == filename)
+    ).values(thumbs=True))
+    thumbs_cache.invalidate(lambda key: key == (root, filename))
+
+
+def render_derivatives(filename, kind):
+    """
+    生成缩略图并记录到 blob，供后台任务调用
+    """
+    if _pil()[0] is None or not filename:
+        return
+    _render(current_app.config[KINDS[kind][0]] + filename, kind)
+    mark_derivatives(filename, kind)
+    db.session.commit()
+
+
+def remove_derivatives(filename, kind):
+    """
+    删除图片的全部缩略图
+    """
+    if not filename:
+        return
+    root, sizes = KINDS[kind]
+    directory = current_app.config[root]
+    for size in sizes:
+        for ext in (None, ".webp"):
+            path = directory + derivative_name(filename, size, ext)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def has_derivatives(filename, kind):
+    """
+    按 blob 中的记录判断缩略图是否已生成，结果在进程内缓存，渲染页面时不访问文件系统
+    """
+    if not filename:
+        return False
+    key = (KINDS[kind][0], filename)
+    ready = thumbs_cache.get(key)
+    if ready is None:
+        ready = bool(db.session.query(Blob.thumbs).filter(
+            Blob.root == key[0], Blob.name == filename
+        ).scalar())
+        thumbs_cache.set(key, ready)
+    return ready
+
+
+def img_srcset(filename, kind, webp=False):
+    """
+    srcset 属性值，如 "/static/uploads/x_262.jpg 262w, ..."；缩略图尚未生成时为空字符串
+    """
+    if not has_derivatives(filename, kind):
+        return ""
+    root, sizes = KINDS[kind]
+    prefix = static_prefix(root)
+    ext = ".webp" if webp else None
+    return ", ".join(
+        "{} {}w".format(url_for("static", filename=prefix + derivative_name(filename, size, ext)), size[0])
+        for size in sizes
+    )
+
+
+def img_url(filename, kind, width=None):
+    """
+    不小于 width 的最小缩略图地址，没有时返回原图地址
+    """
+    root, sizes = KINDS[kind]
+    prefix = static_prefix(root)
+    if width is not None and has_derivatives(filename, kind):
+        for size in sizes:
+            if size[0] >= width:
+                return url_for("static", filename=prefix + derivative_name(filename, size))
+    return url_for("static", filename=prefix + (filename or ""))
@@ -0,0 +1,231 @@
+import csv
+import json
+import os
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, func
+
+from app import db, jobs, storage
+from app.metrics import track
+from app.models import Movie, Preview, Tag
+from app.search import rebuild_index
+
+SECTIONS = ("tags", "movies", "previews")
+
+
+class ManifestError(Exception):
+    pass
+
+
+def load_manifest(path):
+    """
+    读取清单，返回 {"tags": [...], "movies": [...], "previews": [...]}。
+    JSON 为同样结构的对象；CSV 每行一条，type 列为 tag/movie/preview，其余列与 JSON 字段同名。
+    url/cover 为相对清单所在目录的路径
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    manifest = dict((k, []) for k in SECTIONS)
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for k in SECTIONS:
+            manifest[k] = list(data.get(k) or [])
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for line, row in enumerate(csv.DictReader(f), 2):
+                section = (row.pop("type", None) or "").strip() + "s"
+                if section not in manifest:
+                    raise ManifestError("第 {} 行: type 只能是 tag/movie/preview".format(line))
+                manifest[section].append(dict((k, v) for k, v in row.items() if v not in (None, "")))
+    for section in ("movies", "previews"):
+        for item in manifest[section]:
+            for key in ("url", "cover"):
+                if item.get(key):
+                    item[key] = os.path.join(base, item[key])
+    return manifest
+
+
+def _require(item, keys, section, i):
+    for key in keys:
+        if not item.get(key):
+            raise ManifestError("{} 第 {} 条缺少 {}".format(section, i + 1, key))
+
+
+def _movie_row(item, tag_ids, i):
+    _require(item, ("title", "url", "cover", "tag"), "movies", i)
+    release_time = item.get("release_time")
+    return dict(
+        title=item["title"],
+        url=item["url"],
+        cover=item["cover"],
+        info=item.get("info", ""),
+        star=int(item.get("star", 1)),
+        tag_id=tag_ids[item["tag"]],
+        area=item.get("area", ""),
+        release_time=datetime.strptime(release_time, "%Y-%m-%d").date() if release_time else None,
+        length=item.get("length", ""),
+    )
+
+
+def _preview_row(item, tag_ids, i):
+    _require(item, ("title", "cover"), "previews", i)
+    return dict(title=item["title"], cover=item["cover"])
+
+
+def _import_tags(manifest, batch):
+    names = [t["name"] for t in manifest["tags"] if t.get("name")]
+    names += [m["tag"] for m in manifest["movies"] if m.get("tag")]
+    names = list(OrderedDict.fromkeys(names))
+    existing = dict(db.session.query(Tag.name, Tag.id))
+    new = [dict(name=n, addtime=datetime.now()) for n in names if n not in existing]
+    for i in range(0, len(new), batch):
+        db.session.execute(Tag.__table__.insert(), new[i:i + batch])
+    db.session.commit()
+    return dict(db.session.query(Tag.name, Tag.id))
+
+
+def _ambiguous_titles(model, titles, batch):
+    """
+    titles 中在库里对应多条记录的标题，这些条目无法按标题确定要更新哪一条
+    """
+    table = model.__table__
+    titles = list(set(titles))
+    found = []
+    for i in range(0, len(titles), batch):
+        found += [t for t, in db.session.query(table.c.title).filter(
+            table.c.title.in_(titles[i:i + batch])
+        ).group_by(table.c.title).having(func.count() > 1)]
+    return sorted(found)
+
+
+def _upsert(model, rows, file_columns):
+    """
+    按标题把一批记录分为插入和更新，返回 (插入行, 更新行, 文件有变化的 [(标题, 列, 存储名)],
+    新增引用 {存储名: 数量}, 被替换的旧文件 [(存储名, 列)])
+    """
+    table = model.__table__
+    columns = ["id", "title"] + file_columns
+    existing = {}
+    for r in db.session.query(*[table.c[c] for c in columns]).filter(
+        table.c.title.in_([row["title"] for row in rows])
+    ):
+        if r.title in existing:
+            raise ManifestError("{} 标题 {} 对应多条记录".format(table.name, r.title))
+        existing[r.title] = r
+
+    inserts, updates, changed, refs, released = [], [], [], Counter(), []
+    for row in rows:
+        old = existing.get(row["title"])
+        for c in file_columns:
+            if old is None or getattr(old, c) != row[c]:
+                refs[row[c]] += 1
+                changed.append((row["title"], c, row[c]))
+                if old is not None:
+                    released.append((getattr(old, c), c))
+        if old is None:
+            inserts.append(dict(row, addtime=datetime.now()))
+        else:
+            updates.append(dict(row, b_id=old.id))
+    return inserts, updates, changed, refs, released
+
+
+def _write(model, inserts, updates, refs, sizes, released, defaults=None):
+    table = model.__table__
+    # 先登记新引用再释放旧引用，同一批中被换到别处的文件不会被误删
+    storage.add_refs(refs, sizes)
+    dead = [(name, c) for name, c in released if storage.release(name)]
+    if inserts:
+        db.session.execute(table.insert(), [dict(defaults or {}, **row) for row in inserts])
+        if model is Movie:
+            # 批量插入不经过 ORM 钩子
+            track(db.session, "movie", added=len(inserts))
+    if updates:
+        keys = [k for k in updates[0] if k != "b_id"]
+        db.session.execute(
+            table.update().where(table.c.id == bindparam("b_id")).values(
+                dict((k, bindparam(k)) for k in keys)
+            ),
+            updates
+        )
+    return dead
+
+
+def import_catalog(path, batch=1000, workers=8, link=False):
+    """
+    从清单批量导入标签、电影和预告：文件在线程池中并行按内容复制（或硬链接）进上传目录，
+    记录按标题插入或更新，每批一次 executemany 并提交。进度记在 <清单>.progress 中，
+    中断后重新执行从上次提交的批次继续，全部完成后删除进度文件；重复导入同一条目不会重复计数。
+    逐批返回 (分类, 已完成数, 总数)
+    """
+    manifest = load_manifest(path)
+    progress_path = path + ".progress"
+    progress = dict((k, 0) for k in SECTIONS)
+    if os.path.exists(progress_path):
+        with open(progress_path) as f:
+            progress.update(json.load(f))
+
+    app = current_app._get_current_object()
+
+    def ingest(p):
+        # 线程池中没有应用上下文
+        with app.app_context():
+            return storage.ingest(p, link=link)
+
+    # 按标题更新，库中同名的多条记录无法区分，导入前整体检查
+    for section, model in (("movies", Movie), ("previews", Preview)):
+        ambiguous = _ambiguous_titles(model, [item.get("title") for item in manifest[section]], batch)
+        if ambiguous:
+            raise ManifestError("{} 中以下标题在库里有多条记录: {}".format(section, ", ".join(ambiguous)))
+
+    tag_ids = _import_tags(manifest, batch)
+    yield "tags", len(tag_ids), len(tag_ids)
+
+    sections = [
+        ("movies", Movie, _movie_row, ["url", "cover"], dict(play_num=0, comment_num=0)),
+        ("previews", Preview, _preview_row, ["cover"], None),
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for section, model, make_row, file_columns, defaults in sections:
+            items = manifest[section]
+            for start in range(progress[section], len(items), batch):
+                chunk = items[start:start + batch]
+                rows = OrderedDict()
+                for i, item in enumerate(chunk, start):
+                    row = make_row(item, tag_ids, i)
+                    rows[row["title"]] = row
+                rows = list(rows.values())
+
+                paths = list(set(row[c] for row in rows for c in file_columns))
+                stored = dict(zip(paths, pool.map(ingest, paths)))
+                sizes = dict(stored.values())
+                for row in rows:
+                    for c in file_columns:
+                        row[c] = stored[row[c]][0]
+
+                inserts, updates, changed, refs, released = _upsert(model, rows, file_columns)
+                dead = _write(model, inserts, updates, refs, sizes, released, defaults)
+                db.session.commit()
+
+                kinds = dict(url=None, cover="cover")
+                jobs.enqueue_many("unlink", [dict(filename=n, kind=kinds[c]) for n, c in dead])
+                covers = set(name for _, c, name in changed if c == "cover")
+                jobs.enqueue_many("derivatives", [dict(filename=n, kind="cover") for n in covers])
+                titles = [t for t, c, _ in changed if c == "url"]
+                if titles:
+                    # 标题已确认唯一，每个标题只对应本批写入的那一条
+                    ids = [i for i, in db.session.query(Movie.id).filter(Movie.title.in_(titles))]
+                    jobs.enqueue_many("movie_media", [dict(movie_id=i) for i in ids])
+
+                progress[section] = start + len(chunk)
+                with open(progress_path, "w") as f:
+                    json.dump(progress, f)
+                yield section, progress[section], len(items)
+
+    if manifest["movies"]:
+        with db.engine.begin() as conn:
+            rebuild_index(conn)
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
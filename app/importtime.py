@@ -0,0 +1,45 @@
+import subprocess
+import sys
+
+PREFIX = "import time:"
+
+
+def parse(output):
+    """
+    解析 -X importtime 的输出，返回 (总耗时微秒, [(顶层模块, 累计耗时微秒)])，按耗时倒序
+    """
+    top = []
+    for line in output.splitlines():
+        if not line.startswith(PREFIX):
+            continue
+        parts = line[len(PREFIX):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2]
+        # 被其他模块导入的模块名前有额外缩进
+        if name[1:2] == " ":
+            continue
+        top.append((name.strip(), int(parts[1])))
+    top.sort(key=lambda t: t[1], reverse=True)
+    return sum(us for _, us in top), top
+
+
+def measure(module, runs=3, cwd=None):
+    """
+    在新的解释器中以 -X importtime 导入 module，执行 runs 次取总耗时最少的一次
+    """
+    best = None
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import " + module],
+            cwd=cwd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else module)
+        result = parse(proc.stderr)
+        if best is None or result[0] < best[0]:
+            best = result
+    return best
@@ -0,0 +1,319 @@
+import json
+import os
+import signal
+import sqlite3
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from flask import current_app
+
+from app import create_app, db, storage
+from app.catalog import duration_level, invalidate_movie
+from app.images import render_derivatives
+from app.models import Movie
+from app.mp4 import faststart, probe
+from app.search import compact_index
+
+# 已登记的任务: 名称 -> 函数
+TASKS = {}
+
+# 工作进程中的应用，由 _init_process 创建
+_app = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task TEXT NOT NULL,
+    args TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    error TEXT,
+    addtime TEXT NOT NULL,
+    starttime TEXT,
+    endtime TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_job_status_id ON job (status, id);
+"""
+
+
+class Job(object):
+    """
+    任务队列中的一条记录，供后台列表页显示
+    """
+
+    def __init__(self, row):
+        self.id, self.task, args, self.status, self.error, self.addtime, self.starttime, self.endtime = row
+        self.args = json.loads(args)
+
+
+def task(name):
+    """
+    登记一个可以放入队列的任务，参数须能序列化为 JSON
+    """
+
+    def decorator(f):
+        TASKS[name] = f
+        return f
+
+    return decorator
+
+
+def _path():
+    # 默认放在 Flask 的 instance 目录（项目根目录下的 instance/），不在 app 包内
+    path = current_app.config.get("JOB_DB")
+    if path is None:
+        os.makedirs(current_app.instance_path, exist_ok=True)
+        path = os.path.join(current_app.instance_path, "jobs.sqlite")
+    return path
+
+
+def _connect():
+    # isolation_level=None: 由下面的语句自己控制事务
+    conn = sqlite3.connect(_path(), timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def enqueue(task_name, **kwargs):
+    """
+    放入一个任务，立即返回任务编号，由 flask jobs-worker 在后台执行
+    """
+    if task_name not in TASKS:
+        raise KeyError(task_name)
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            "INSERT INTO job (task, args, addtime) VALUES (?, ?, ?)",
+            (task_name, json.dumps(kwargs), _now())
+        )
+        return cur.lastrowid
+    finally:
+        conn.close()
+
+
+def enqueue_many(task_name, items):
+    """
+    批量放入同一种任务，items 为参数字典列表
+    """
+    if task_name not in TASKS:
+        raise KeyError(task_name)
+    if not items:
+        return
+    now = _now()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO job (task, args, addtime) VALUES (?, ?, ?)",
+            [(task_name, json.dumps(kwargs), now) for kwargs in items]
+        )
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def get(job_id):
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT id, task, args, status, error, addtime, starttime, endtime FROM job WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return Job(row) if row else None
+
+
+def recent(page=1, per_page=10):
+    """
+    按编号倒序分页，返回 (任务列表, 总数)
+    """
+    conn = _connect()
+    try:
+        total = conn.execute("SELECT COUNT(*) FROM job").fetchone()[0]
+        rows = conn.execute(
+            "SELECT id, task, args, status, error, addtime, starttime, endtime FROM job "
+            "ORDER BY id DESC LIMIT ? OFFSET ?",
+            (per_page, (page - 1) * per_page)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [Job(row) for row in rows], total
+
+
+def _claim(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT id, task, args FROM job WHERE status = 'queued' ORDER BY id LIMIT 1"
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE job SET status = 'running', starttime = ? WHERE id = ?", (_now(), row[0])
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+
+def _finish(conn, job_id, error=None):
+    conn.execute(
+        "UPDATE job SET status = ?, error = ?, endtime = ? WHERE id = ?",
+        ("failed" if error else "done", error, _now(), job_id)
+    )
+
+
+def _init_process(config):
+    # 按父进程的配置创建应用，使用自己的数据库连接
+    global _app
+    _app = create_app(config)
+
+
+def _execute(task_name, args):
+    """
+    在工作进程中执行任务，返回错误信息，成功时为 None
+    """
+    with _app.app_context():
+        try:
+            TASKS[task_name](**json.loads(args))
+        except Exception:
+            db.session.rollback()
+            return traceback.format_exc()
+        finally:
+            db.session.remove()
+    return None
+
+
+def _error(future):
+    try:
+        return future.result()
+    except Exception:
+        return traceback.format_exc()
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _new_pool(workers):
+    return ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_process, initargs=(dict(current_app.config),)
+    )
+
+
+def run_worker(workers=None, poll=1.0):
+    """
+    不断从队列中取出任务交给进程池执行，收到 SIGTERM/SIGINT 时等正在执行的任务结束后退出；
+    启动时把上次异常退出时仍在执行的任务重新放回队列。
+    子进程异常退出（段错误、被 OOM 杀掉等）时进程池不能再用，正在执行的任务记为失败，重建进程池后继续
+    """
+    workers = workers or current_app.config.get("JOB_WORKERS", os.cpu_count() or 1)
+    signal.signal(signal.SIGTERM, _stop)
+    conn = _connect()
+    conn.execute("UPDATE job SET status = 'queued', starttime = NULL WHERE status = 'running'")
+    running = {}
+    pool = _new_pool(workers)
+    try:
+        while True:
+            broken = False
+            while len(running) < workers:
+                row = _claim(conn)
+                if row is None:
+                    break
+                try:
+                    running[pool.submit(_execute, row[1], row[2])] = row[0]
+                except BrokenProcessPool:
+                    # 还没有执行，放回队列
+                    conn.execute("UPDATE job SET status = 'queued', starttime = NULL WHERE id = ?", (row[0],))
+                    broken = True
+                    break
+            if running:
+                done, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _finish(conn, running.pop(future), _error(future))
+                    broken = broken or isinstance(future.exception(), BrokenProcessPool)
+            elif not broken:
+                time.sleep(poll)
+            if broken:
+                current_app.logger.error("jobs: worker process died, restarting the pool")
+                for future, job_id in running.items():
+                    _finish(conn, job_id, _error(future))
+                running.clear()
+                pool.shutdown(wait=False)
+                pool = _new_pool(workers)
+    except KeyboardInterrupt:
+        # 等正在执行的任务结束
+        pool.shutdown(wait=True)
+        for future, job_id in running.items():
+            _finish(conn, job_id, _error(future))
+    finally:
+        pool.shutdown(wait=True)
+
+
+@task("derivatives")
+def derivatives(filename, kind):
+    """
+    生成图片的缩略图
+    """
+    render_derivatives(filename, kind)
+
+
+@task("unlink")
+def unlink(filename, root="UP_DIR", kind=None):
+    """
+    删除已无引用的文件及其缩略图，执行前又被引用的不删除
+    """
+    storage.unlink(filename, root, kind)
+
+
+@task("movie_media")
+def movie_media(movie_id):
+    """
+    视频 moov 前置（内容改变，按新内容重新存储）并读取时长/分辨率/码率
+    """
+    movie = Movie.query.get(movie_id)
+    if movie is None:
+        return
+    old = movie.url
+    new = storage.rewrite(old, faststart)
+    if new is not None:
+        table = Movie.__table__
+        # 执行期间电影被编辑过时放弃改写
+        changed = db.session.execute(
+            table.update().where((table.c.id == movie_id) & (table.c.url == old)).values(url=new)
+        ).rowcount
+        stale = old if changed else new
+        dead = storage.release(stale)
+        db.session.commit()
+        if dead:
+            storage.unlink(stale)
+        movie = Movie.query.get(movie_id)
+        if movie is None:
+            return
+    media = probe(current_app.config["UP_DIR"] + movie.url) or {}
+    movie.duration = media.get("duration")
+    movie.duration_level = duration_level(movie.duration)
+    movie.width = media.get("width")
+    movie.height = media.get("height")
+    movie.bitrate = media.get("bitrate")
+    db.session.commit()
+    # 片长档位变化，首页按片长筛选的列表需要刷新
+    invalidate_movie((movie.tag_id, movie.star))
+
+
+@task("search_compact")
+def search_compact():
+    """
+    把电影编辑产生的搜索索引增量合并进倒排表
+    """
+    with db.engine.begin() as conn:
+        compact_index(conn)
@@ -0,0 +1,68 @@
+import atexit
+from collections import OrderedDict
+from datetime import datetime
+
+from app import db
+from app.buffer import BufferedWriter
+from app.metrics import record_days
+from app.models import UserLog
+from app.partitions import allocate_ids, ensure_partition, month_key
+
+
+class LogWriter(BufferedWriter):
+    """
+    日志写缓冲：请求中只把记录放入内存队列，由后台线程每隔 interval 秒
+    （或累计超过 size 条时）按月分表批量插入；进程退出时写入剩余的记录
+    """
+
+    name = "log-writer"
+    config_prefix = "LOG"
+
+    def __init__(self, interval=2, size=500, limit=100000):
+        super(LogWriter, self).__init__(interval, size, limit)
+
+    def _empty(self):
+        return []  # [(模型, 行)]
+
+    def _put(self, pending, model, values):
+        pending.append((model, values))
+
+    def _merge(self, older, newer):
+        return older + newer
+
+    def _trim(self, pending, limit):
+        # 丢弃最旧的记录
+        return pending[-limit:]
+
+    def _write(self, pending):
+        partitions = OrderedDict()
+        for model, values in pending:
+            partitions.setdefault((model, month_key(values["addtime"])), []).append(values)
+        # 建表语句在 MySQL 中会隐式提交，先于插入的事务执行
+        tables = [
+            (model, ensure_partition(db.engine, model, month), rows)
+            for (model, month), rows in partitions.items()
+        ]
+        with db.engine.begin() as conn:
+            for model, table, rows in tables:
+                # 各月分表共用编号序列，写入失败重试时重新分配
+                first = allocate_ids(conn, model, len(rows))
+                conn.execute(table.insert(), [dict(values, id=first + i) for i, values in enumerate(rows)])
+            record_days(conn, "login", [
+                values["addtime"].date() for model, values in pending if model is UserLog
+            ])
+
+    def add(self, model, **values):
+        """
+        记录一条日志，addtime 取调用时的时间
+        """
+        values.setdefault("addtime", datetime.now())
+        self._add(model, values)
+
+
+log_writer = LogWriter()
+atexit.register(log_writer.flush)
+
+
+def init_app(app):
+    log_writer.init_app(app)
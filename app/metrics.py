@@ -0,0 +1,186 @@
+import atexit
+from collections import Counter, OrderedDict
+from datetime import date, timedelta
+
+from sqlalchemy import event, func, literal, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+
+from app import db
+from app.buffer import BufferedWriter
+from app.models import Comment, LogDaily, MetricDaily, Movie, MovieCol, User, UserLog
+from app.partitions import as_date, partition_months, partition_table
+
+# 由 ORM 钩子累加的统计项: 模型 -> 名称
+TRACKED = OrderedDict([
+    (User, "user"),
+    (Movie, "movie"),
+    (Comment, "comment"),
+    (MovieCol, "moviecol"),
+])
+
+# 后台首页显示的统计项及名称，login 由日志写缓冲累加
+LABELS = OrderedDict([
+    ("user", "会员"),
+    ("movie", "电影"),
+    ("comment", "评论"),
+    ("moviecol", "收藏"),
+    ("login", "会员登录"),
+])
+
+
+def record(bind, name, day, added=0, removed=0):
+    """
+    在 bind（会话或连接）的当前事务中累加某一天的统计
+    """
+    table = MetricDaily.__table__
+    where = (table.c.name == name) & (table.c.day == day)
+    update = table.update().where(where).values(
+        added=table.c.added + added, removed=table.c.removed + removed
+    )
+    if bind.execute(update).rowcount:
+        return
+    try:
+        # 插入放在保存点中，冲突时只回滚这一条，外层事务仍可继续
+        with bind.begin_nested():
+            bind.execute(table.insert().values(name=name, day=day, added=added, removed=removed))
+    except IntegrityError:
+        # 当天第一条被并发写入，对方已经插入
+        bind.execute(update)
+
+
+def record_days(bind, name, days):
+    """
+    按天批量累加新增数，days 为 {日期: 数量}
+    """
+    for day, n in sorted(Counter(days).items()):
+        record(bind, name, day, added=n)
+
+
+class MetricsBuffer(BufferedWriter):
+    """
+    统计写缓冲：业务事务提交后只在内存里累加，由后台线程每隔 interval 秒
+    （或累计超过 size 项时）在单独的事务中写入 metricDaily，
+    业务写入不再争用同一天的统计行
+    """
+
+    name = "metrics-buffer"
+    config_prefix = "METRICS"
+
+    def _empty(self):
+        return {}  # {(名称, 日期): [新增, 删除]}
+
+    def _put(self, pending, name, day, added=0, removed=0):
+        counts = pending.setdefault((name, day), [0, 0])
+        counts[0] += added
+        counts[1] += removed
+
+    def _merge(self, older, newer):
+        for (name, day), (added, removed) in newer.items():
+            self._put(older, name, day, added, removed)
+        return older
+
+    def _trim(self, pending, limit):
+        # 保留最近的日期
+        return dict(sorted(pending.items(), key=lambda item: item[0][1])[-limit:])
+
+    def _write(self, pending):
+        with db.engine.begin() as conn:
+            for (name, day), (added, removed) in sorted(pending.items()):
+                record(conn, name, day, added, removed)
+
+    def incr(self, name, day, added=0, removed=0):
+        self._add(name, day, added, removed)
+
+
+metrics_buffer = MetricsBuffer()
+atexit.register(metrics_buffer.flush)
+
+
+def track(session, name, added=0, removed=0):
+    """
+    在会话中记下当天的统计变化，事务提交后才放入写缓冲，回滚时丢弃
+    """
+    counts = session.info.setdefault("metrics", Counter())
+    counts[(name, "added")] += added
+    counts[(name, "removed")] += removed
+
+
+def _inserted(mapper, connection, target):
+    track(object_session(target), TRACKED[mapper.class_], added=1)
+
+
+def _deleted(mapper, connection, target):
+    track(object_session(target), TRACKED[mapper.class_], removed=1)
+
+
+def _committed(session):
+    counts = session.info.pop("metrics", None)
+    if not counts:
+        return
+    today = date.today()
+    for name in set(name for name, _ in counts):
+        metrics_buffer.incr(name, today, counts[(name, "added")], counts[(name, "removed")])
+
+
+def _rolled_back(session):
+    session.info.pop("metrics", None)
+
+
+def init_app(app):
+    metrics_buffer.init_app(app)
+    for model in TRACKED:
+        if not event.contains(model, "after_insert", _inserted):
+            event.listen(model, "after_insert", _inserted)
+            event.listen(model, "after_delete", _deleted)
+    if not event.contains(Session, "after_commit", _committed):
+        event.listen(Session, "after_commit", _committed)
+        event.listen(Session, "after_rollback", _rolled_back)
+
+
+def backfill(conn):
+    """
+    从已有数据重新生成按天统计：各表按 addtime 分组，登录数取日志月分表和已汇总的 logDaily
+    """
+    table = MetricDaily.__table__
+    columns = ["name", "day", "added", "removed"]
+    conn.execute(table.delete())
+    for model, name in TRACKED.items():
+        day = func.date(model.addtime)
+        conn.execute(table.insert().from_select(columns, select([
+            literal(name), day, func.count(), literal(0)
+        ]).select_from(model.__table__).group_by(day)))
+    days = Counter()
+    for month in partition_months(UserLog):
+        part = partition_table(UserLog, month)
+        day = func.date(part.c.addtime)
+        for d, n in conn.execute(select([day, func.count()]).group_by(day)):
+            days[as_date(d)] += n
+    daily = LogDaily.__table__
+    for d, n in conn.execute(select([daily.c.day, func.sum(daily.c.count)]).where(
+        daily.c.log == UserLog.__tablename__
+    ).group_by(daily.c.day)):
+        days[as_date(d)] += int(n)
+    for day, n in days.items():
+        conn.execute(table.insert().values(name="login", day=day, added=n, removed=0))
+
+
+def dashboard(days=7):
+    """
+    返回 (各项总数 {名称: 数量}, 最近 days 天每天的新增 [(日期, {名称: 数量})])，只读统计表
+    """
+    table = MetricDaily.__table__
+    totals = dict((name, 0) for name in LABELS)
+    for name, added, removed in db.session.execute(select([
+        table.c.name, func.sum(table.c.added), func.sum(table.c.removed)
+    ]).group_by(table.c.name)):
+        totals[name] = int(added or 0) - int(removed or 0)
+    start = date.today() - timedelta(days=days - 1)
+    recent = dict(((name, day), added) for name, day, added in db.session.execute(
+        select([table.c.name, table.c.day, table.c.added]).where(table.c.day >= start)
+    ))
+    series = []
+    for i in range(days):
+        day = start + timedelta(days=i)
+        series.append((day, dict((name, recent.get((name, day), 0)) for name in LABELS)))
+    return totals, series
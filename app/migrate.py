@@ -0,0 +1,317 @@
+import datetime
+import itertools
+import os
+
+from flask import current_app
+from sqlalchemy import Column, MetaData, String, Table, UniqueConstraint, inspect, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateColumn, DropConstraint
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from app import db
+from app.catalog import DURATIONS, movie_query, movie_order
+from app.images import KINDS, derivative_name
+from app.models import SchemaVersion, Movie, SearchTerm, SearchDelta, Blob, Preview, User, Role, RoleAuth, \
+    LogDaily, MetricDaily, CacheVersion, IdSequence
+from app.metrics import backfill as backfill_metrics
+from app.pagination import keyset_query
+from app.partitions import PARTITIONED, max_id, migrate_rows
+from app.search import rebuild_index
+
+# 已登记的迁移: [(版本号, 说明, 函数)]
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """
+    登记一个迁移，函数接收一个处于事务中的连接
+    """
+
+    def decorator(f):
+        MIGRATIONS.append((version, name, f))
+        return f
+
+    return decorator
+
+
+def add_columns(conn, table, names):
+    """
+    按名称添加模型中声明的列及其索引，已存在的跳过
+    """
+    existing = set(c["name"] for c in inspect(conn).get_columns(table.name))
+    for name in names:
+        if name not in existing:
+            column = CreateColumn(table.c[name]).compile(dialect=conn.dialect)
+            conn.execute("ALTER TABLE {} ADD COLUMN {}".format(
+                conn.dialect.identifier_preparer.quote(table.name), column
+            ))
+    create_indexes(conn, table, [
+        ix.name for ix in table.indexes if any(c.name in names for c in ix.columns)
+    ])
+
+
+def create_indexes(conn, table, names):
+    """
+    按名称创建模型中声明的索引，已存在的跳过
+    """
+    existing = set(ix["name"] for ix in inspect(conn).get_indexes(table.name))
+    for index in table.indexes:
+        if index.name in names and index.name not in existing:
+            index.create(bind=conn)
+
+
+def _rebuild_sqlite(conn, table):
+    """
+    SQLite 不能删除建表时声明的约束，按模型重建表并复制数据
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    insp = inspect(conn)
+    existing = set(c["name"] for c in insp.get_columns(table.name))
+    columns = ", ".join(quote(c.name) for c in table.columns if c.name in existing)
+    old = "_{}_old".format(table.name)
+    for ix in insp.get_indexes(table.name):
+        conn.execute("DROP INDEX {}".format(quote(ix["name"])))
+    # 改名时不改写其他表中指向该表的外键，重建后仍指向新表
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    conn.execute("ALTER TABLE {} RENAME TO {}".format(quote(table.name), quote(old)))
+    conn.execute("PRAGMA legacy_alter_table = OFF")
+    table.create(bind=conn)
+    conn.execute("INSERT INTO {} ({}) SELECT {} FROM {}".format(
+        quote(table.name), columns, columns, quote(old)
+    ))
+    conn.execute("DROP TABLE {}".format(quote(old)))
+
+
+def drop_unique(conn, table, names):
+    """
+    删除只包含单个列的唯一约束，并创建模型中为这些列声明的普通索引
+    """
+    unique = [
+        uc for uc in inspect(conn).get_unique_constraints(table.name)
+        if len(uc["column_names"]) == 1 and uc["column_names"][0] in names
+    ]
+    if unique and conn.dialect.name == "sqlite":
+        _rebuild_sqlite(conn, table)
+        return
+    for uc in unique:
+        stub = Table(table.name, MetaData(), *[Column(c, String(255)) for c in uc["column_names"]])
+        conn.execute(DropConstraint(UniqueConstraint(
+            *[stub.c[c] for c in uc["column_names"]], name=uc["name"]
+        )))
+    create_indexes(conn, table, [
+        ix.name for ix in table.indexes if any(c.name in names for c in ix.columns)
+    ])
+
+
+def drop_columns(conn, table, names):
+    """
+    删除模型中已不再声明的列，不存在的跳过
+    """
+    existing = set(c["name"] for c in inspect(conn).get_columns(table.name))
+    names = [n for n in names if n in existing]
+    if names and conn.dialect.name == "sqlite":
+        _rebuild_sqlite(conn, table)
+        return
+    for name in names:
+        conn.execute("ALTER TABLE {} DROP COLUMN {}".format(
+            conn.dialect.identifier_preparer.quote(table.name),
+            conn.dialect.identifier_preparer.quote(name)
+        ))
+
+
+@migration(1, "电影列表 标签/星级 × 排序 复合索引")
+def movie_catalog_indexes(conn):
+    create_indexes(conn, Movie.__table__, [
+        "ix_movie_tag_id_id",
+        "ix_movie_star_id",
+        "ix_movie_tag_star_id",
+        "ix_movie_play_num_id",
+        "ix_movie_comment_num_id",
+        "ix_movie_tag_addtime_id",
+        "ix_movie_tag_play_num_id",
+        "ix_movie_tag_comment_num_id",
+        "ix_movie_star_addtime_id",
+        "ix_movie_star_play_num_id",
+        "ix_movie_star_comment_num_id",
+        "ix_movie_tag_star_addtime_id",
+        "ix_movie_tag_star_play_num_id",
+        "ix_movie_tag_star_comment_num_id",
+    ])
+
+
+@migration(2, "电影搜索倒排索引（中文双字切分，压缩倒排表加增量）")
+def movie_search_index(conn):
+    SearchTerm.__table__.create(bind=conn, checkfirst=True)
+    SearchDelta.__table__.create(bind=conn, checkfirst=True)
+    rebuild_index(conn)
+
+
+@migration(4, "电影时长/分辨率/码率")
+def movie_media_info(conn):
+    add_columns(conn, Movie.__table__, ["duration", "width", "height", "bitrate"])
+
+
+@migration(5, "上传文件按内容去重存储")
+def upload_blobs(conn):
+    Blob.__table__.create(bind=conn, checkfirst=True)
+    # 同一文件可以被多行引用
+    drop_unique(conn, Movie.__table__, ["url", "cover"])
+    drop_unique(conn, Preview.__table__, ["cover"])
+    drop_unique(conn, User.__table__, ["avatar"])
+
+
+@migration(6, "角色权限改用关联表")
+def role_auth_table(conn):
+    pairs = set()
+    if "auths" in set(c["name"] for c in inspect(conn).get_columns("role")):
+        auth_ids = set(i for i, in conn.execute("SELECT id FROM auth"))
+        for role_id, auths in conn.execute("SELECT id, auths FROM role"):
+            for i in (auths or "").split(","):
+                # 忽略已被删除的权限
+                if i.strip().isdigit() and int(i) in auth_ids:
+                    pairs.add((role_id, int(i)))
+    # MySQL 的 DDL 会隐式提交，旧列放到最后删除，前面失败时权限数据仍在，可以重新执行
+    RoleAuth.__table__.create(bind=conn, checkfirst=True)
+    if pairs:
+        existing = set(tuple(r) for r in conn.execute(
+            select([RoleAuth.__table__.c.role_id, RoleAuth.__table__.c.auth_id])
+        ))
+        new = [dict(role_id=r, auth_id=a) for r, a in sorted(pairs - existing)]
+        if new:
+            conn.execute(RoleAuth.__table__.insert(), new)
+    drop_columns(conn, Role.__table__, ["auths"])
+
+
+@migration(7, "日志按月分表与按天汇总")
+def log_partitions(conn):
+    LogDaily.__table__.create(bind=conn, checkfirst=True)
+    for model in PARTITIONED:
+        migrate_rows(conn, model)
+
+
+@migration(8, "后台首页按天统计")
+def daily_metrics(conn):
+    MetricDaily.__table__.create(bind=conn, checkfirst=True)
+    backfill_metrics(conn)
+
+
+@migration(9, "多进程共用的缓存版本号")
+def cache_versions(conn):
+    CacheVersion.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(10, "记录图片缩略图是否已生成")
+def blob_thumbs(conn):
+    add_columns(conn, Blob.__table__, ["thumbs"])
+    table = Blob.__table__
+    # 按磁盘上已有的缩略图补记录，此后由生成缩略图的任务写入
+    for kind, (root, sizes) in KINDS.items():
+        directory = current_app.config[root]
+        names = [n for n, in conn.execute(select([table.c.name]).where(table.c.root == root)) if all(
+            os.path.exists(directory + derivative_name(n, size, ext)) for size in sizes for ext in (None, ".webp")
+        )]
+        for i in range(0, len(names), 500):
+            conn.execute(table.update().where(
+                (table.c.root == root) & table.c.name.in_(names[i:i + 500])
+            ).values(thumbs=True))
+
+
+@migration(11, "日志各月分表共用编号序列")
+def log_id_sequence(conn):
+    IdSequence.__table__.create(bind=conn, checkfirst=True)
+    table = IdSequence.__table__
+    for model in PARTITIONED:
+        name = model.__tablename__
+        if conn.execute(select([table.c.name]).where(table.c.name == name)).scalar() is None:
+            conn.execute(table.insert().values(name=name, value=max_id(conn, model)))
+
+
+@migration(12, "电影片长档位与复合索引")
+def movie_duration_level(conn):
+    add_columns(conn, Movie.__table__, ["duration_level"])
+    table = Movie.__table__
+    conn.execute(table.update().values(duration_level=0))
+    for level, (low, high) in DURATIONS.items():
+        where = table.c.duration >= low * 60
+        if high is not None:
+            where = where & (table.c.duration < high * 60)
+        conn.execute(table.update().where(where).values(duration_level=level))
+
+
+def upgrade():
+    """
+    依次执行未执行过的迁移，返回本次执行的 [(版本号, 说明)]
+    """
+    SchemaVersion.__table__.create(bind=db.engine, checkfirst=True)
+    applied = set(v for v, in db.session.query(SchemaVersion.version))
+    db.session.remove()
+    done = []
+    for version, name, f in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        with db.engine.begin() as conn:
+            f(conn)
+            conn.execute(SchemaVersion.__table__.insert(), version=version, name=name)
+        done.append((version, name))
+    return done
+
+
+class explain(Executable, ClauseElement):
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(explain)
+def _compile_explain(element, compiler, **kw):
+    if compiler.dialect.name == "sqlite":
+        return "EXPLAIN QUERY PLAN " + compiler.process(element.statement, **kw)
+    return "EXPLAIN " + compiler.process(element.statement, **kw)
+
+
+def _plan_problems(rows, dialect, pk_scan=False):
+    """
+    从执行计划中找出全表扫描和额外排序；pk_scan 为真时按主键顺序扫描是预期的
+    （不带筛选按 id 排序的第一页，读到 LIMIT 行即停止）
+    """
+    problems = []
+    for row in rows:
+        row = dict(row)
+        if dialect == "sqlite":
+            detail = row["detail"]
+            scan = detail.startswith("SCAN") and "USING" not in detail
+            if (scan and not pk_scan) or "TEMP B-TREE" in detail:
+                problems.append(detail)
+        else:
+            extra = row.get("Extra") or ""
+            if (row.get("type") == "ALL" and not pk_scan) or "filesort" in extra:
+                problems.append("type={} Extra={}".format(row.get("type"), extra))
+    return problems
+
+
+def check_catalog_indexes(per_page=10):
+    """
+    对首页每种 标签/星级/片长 筛选 × 排序 组合（第一页与游标翻页）执行 EXPLAIN，
+    返回出现全表扫描或额外排序的 [(参数, 问题)]，全部走索引时为空
+    """
+    dialect = db.engine.dialect.name
+    seek_values = {
+        "addtime": datetime.datetime.now(),
+        "play_num": 0,
+        "comment_num": 0,
+        "id": 0,
+    }
+    failures = []
+    for tid, star, dur in itertools.product((0, 1), (0, 1), (0, 1)):
+        # (0, 0, 0) 为默认的按 id 排序
+        for time, pm, cm in ((0, 0, 0), (1, 0, 0), (2, 0, 0), (0, 1, 0), (0, 2, 0), (0, 0, 1), (0, 0, 2)):
+            order = movie_order(time, pm, cm)
+            values = [seek_values[col.key] for col, _ in order]
+            for seek in (None, values):
+                query = keyset_query(movie_query(tid, star, dur), order, seek).limit(per_page + 1)
+                rows = db.session.execute(explain(query.statement)).fetchall()
+                pk_scan = tid == 0 and star == 0 and dur == 0 and len(order) == 1 and seek is None
+                problems = _plan_problems(rows, dialect, pk_scan)
+                if problems:
+                    p = dict(tid=tid, star=star, dur=dur, time=time, pm=pm, cm=cm, seek=seek is not None)
+                    failures.append((p, problems))
+    return failures
@@ -12,7 +12,7 @@ class User(db.Model):
     email = db.Column(db.String(100), unique=True)  # 邮箱
     phone = db.Column(db.String(11), unique=True)  # 手机号
     info = db.Column(db.Text)  # 个人简介
-    avatar = db.Column(db.String(255), unique=True)  # 头像
+    avatar = db.Column(db.String(255), index=True)  # 头像
     addtime = db.Column(db.DateTime, index=True,
                         default=datetime.now)  # 注册时间
     uuid = db.Column(db.String(255), unique=True)  # 唯一标志符
@@ -60,9 +60,9 @@ class Movie(db.Model):
     __tablename__ = "movie"
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255))  # 片名
-    url = db.Column(db.String(255), unique=True)  # 播放地址
+    url = db.Column(db.String(255), index=True)  # 播放地址
     info = db.Column(db.Text)  # 简介
-    cover = db.Column(db.String(255), unique=True)  # 封面
+    cover = db.Column(db.String(255), index=True)  # 封面
     star = db.Column(db.SmallInteger)  # 星级
     play_num = db.Column(db.BigInteger)  # 播放量
     comment_num = db.Column(db.BigInteger)  # 评论量
@@ -70,21 +70,93 @@ class Movie(db.Model):
     area = db.Column(db.String(255))  # 上映地区
     release_time = db.Column(db.Date)  # 上映时间
     length = db.Column(db.String(100))  # 片长
+    duration = db.Column(db.Integer, index=True)  # 时长(秒), 上传时从文件读取
+    duration_level = db.Column(db.SmallInteger, default=0)  # 片长筛选档位, 由 duration 得出, 0 为未知
+    width = db.Column(db.Integer)  # 视频宽度
+    height = db.Column(db.Integer)  # 视频高度
+    bitrate = db.Column(db.Integer)  # 平均码率(kbps)
     addtime = db.Column(db.DateTime, index=True,
                         default=datetime.now)  # 添加时间
     comments = db.relationship("Comment", backref="movie")  # 评论外键关系关联
     movie_cols = db.relationship("MovieCol", backref="movie")  # 收藏外键关系关联
+    # 首页 标签/星级/片长 筛选 × 默认(id)/添加时间/播放量/评论量 排序 的复合索引, id 用于游标分页；
+    # 片长与标签或星级同时筛选时走标签/星级的索引
+    __table_args__ = (
+        db.Index("ix_movie_tag_id_id", "tag_id", "id"),
+        db.Index("ix_movie_star_id", "star", "id"),
+        db.Index("ix_movie_tag_star_id", "tag_id", "star", "id"),
+        db.Index("ix_movie_play_num_id", "play_num", "id"),
+        db.Index("ix_movie_comment_num_id", "comment_num", "id"),
+        db.Index("ix_movie_tag_addtime_id", "tag_id", "addtime", "id"),
+        db.Index("ix_movie_tag_play_num_id", "tag_id", "play_num", "id"),
+        db.Index("ix_movie_tag_comment_num_id", "tag_id", "comment_num", "id"),
+        db.Index("ix_movie_star_addtime_id", "star", "addtime", "id"),
+        db.Index("ix_movie_star_play_num_id", "star", "play_num", "id"),
+        db.Index("ix_movie_star_comment_num_id", "star", "comment_num", "id"),
+        db.Index("ix_movie_tag_star_addtime_id", "tag_id", "star", "addtime", "id"),
+        db.Index("ix_movie_tag_star_play_num_id", "tag_id", "star", "play_num", "id"),
+        db.Index("ix_movie_tag_star_comment_num_id", "tag_id", "star", "comment_num", "id"),
+        db.Index("ix_movie_duration_level_id", "duration_level", "id"),
+        db.Index("ix_movie_duration_level_addtime_id", "duration_level", "addtime", "id"),
+        db.Index("ix_movie_duration_level_play_num_id", "duration_level", "play_num", "id"),
+        db.Index("ix_movie_duration_level_comment_num_id", "duration_level", "comment_num", "id"),
+    )
 
     def __repr__(self):
         return "<Movie {}>".format(self.title)
 
 
+# 电影搜索倒排索引
+class SearchTerm(db.Model):
+    __tablename__ = "searchTerm"
+    token = db.Column(db.String(64), primary_key=True)  # 词
+    df = db.Column(db.Integer)  # 包含该词的电影数
+    postings = db.Column(db.LargeBinary(16777215))  # 倒排表, 按电影 id 升序的 (id 差值, 权重) varint 序列
+
+    def __repr__(self):
+        return "<SearchTerm {}>".format(self.token)
+
+
+# 电影搜索倒排索引的增量, 编辑电影时只追加, 由后台任务按 id 顺序合并进 searchTerm
+class SearchDelta(db.Model):
+    __tablename__ = "searchDelta"
+    id = db.Column(db.Integer, primary_key=True)  # 编号, 决定合并顺序
+    token = db.Column(db.String(64))  # 词
+    movie_id = db.Column(db.Integer)  # 电影
+    weight = db.Column(db.Integer)  # 新的权重, 0 表示从该词中删除
+    __table_args__ = (
+        db.Index("ix_searchDelta_token_id", "token", "id"),
+    )
+
+    def __repr__(self):
+        return "<SearchDelta {} {}>".format(self.token, self.movie_id)
+
+
+# 上传文件, 按内容摘要去重存储
+class Blob(db.Model):
+    __tablename__ = "blob"
+    id = db.Column(db.Integer, primary_key=True)  # 编号
+    root = db.Column(db.String(20))  # 所在目录的配置项, UP_DIR 或 USER_DIR
+    name = db.Column(db.String(255))  # 相对路径, 由 sha256 摘要决定
+    size = db.Column(db.BigInteger)  # 文件大小
+    refcount = db.Column(db.Integer, default=1)  # 引用数, 为 0 时删除文件
+    thumbs = db.Column(db.Boolean, default=False)  # 图片的缩略图是否已生成
+    addtime = db.Column(db.DateTime, index=True,
+                        default=datetime.now)  # 添加时间
+    __table_args__ = (
+        db.UniqueConstraint("root", "name", name="uq_blob_root_name"),
+    )
+
+    def __repr__(self):
+        return "<Blob {}>".format(self.name)
+
+
 # 预告
 class Preview(db.Model):
     __tablename__ = "preview"
     id = db.Column(db.Integer, primary_key=True)  # 编号
     title = db.Column(db.String(255), unique=True)  # 标题
-    cover = db.Column(db.String(255), unique=True)  # 封面
+    cover = db.Column(db.String(255), index=True)  # 封面
     addtime = db.Column(db.DateTime, index=True,
                         default=datetime.now)  # 添加时间
 
@@ -137,15 +209,25 @@ class Role(db.Model):
     __tablename__ = "role"
     id = db.Column(db.Integer, primary_key=True)  # 编号
     name = db.Column(db.String(255), unique=True)  # 名称
-    auths = db.Column(db.String(600))  # 权限地址
     addtime = db.Column(db.DateTime, index=True,
                         default=datetime.now)  # 添加时间
     admins = db.relationship("Admin", backref="role")  # 管理员关系外键
+    auths = db.relationship("Auth", secondary="roleAuth", backref="roles")  # 拥有的权限
 
     def __repr__(self):
         return "<Role {}>".format(self.name)
 
 
+# 角色权限
+class RoleAuth(db.Model):
+    __tablename__ = "roleAuth"
+    role_id = db.Column(db.Integer, db.ForeignKey("role.id"), primary_key=True)  # 所属角色
+    auth_id = db.Column(db.Integer, db.ForeignKey("auth.id"), primary_key=True, index=True)  # 所属权限
+
+    def __repr__(self):
+        return "<RoleAuth {} {}>".format(self.role_id, self.auth_id)
+
+
 # 管理员
 class Admin(db.Model):
     __tablename__ = "admin"
@@ -194,6 +276,69 @@ class OpLog(db.Model):
         return "<OpLog {}>".format(self.id)
 
 
+# 日志按天汇总，原始日志的月分区过了保留期后汇总到这里再删除
+class LogDaily(db.Model):
+    __tablename__ = "logDaily"
+    id = db.Column(db.Integer, primary_key=True)  # 编号
+    log = db.Column(db.String(20))  # 日志表名, 如 userLog
+    day = db.Column(db.Date)  # 日期
+    owner_id = db.Column(db.Integer)  # 所属会员/管理员
+    count = db.Column(db.Integer)  # 当天条数
+    __table_args__ = (
+        db.UniqueConstraint("log", "day", "owner_id", name="uq_logDaily_log_day_owner"),
+    )
+
+    def __repr__(self):
+        return "<LogDaily {} {}>".format(self.log, self.day)
+
+
+# 后台首页统计，每类数据每天一行，由写入时的钩子累加
+class MetricDaily(db.Model):
+    __tablename__ = "metricDaily"
+    id = db.Column(db.Integer, primary_key=True)  # 编号
+    name = db.Column(db.String(20))  # 统计项, 如 user、comment、login
+    day = db.Column(db.Date)  # 日期
+    added = db.Column(db.Integer, default=0)  # 当天新增
+    removed = db.Column(db.Integer, default=0)  # 当天删除
+    __table_args__ = (
+        db.UniqueConstraint("name", "day", name="uq_metricDaily_name_day"),
+    )
+
+    def __repr__(self):
+        return "<MetricDaily {} {}>".format(self.name, self.day)
+
+
+# 缓存版本号，数据变化时加一，各进程的缓存键带上版本号，旧条目不再被读取
+class CacheVersion(db.Model):
+    __tablename__ = "cacheVersion"
+    name = db.Column(db.String(64), primary_key=True)  # 缓存名称, 如 catalog:1:0
+    version = db.Column(db.Integer, default=0)  # 版本号
+
+    def __repr__(self):
+        return "<CacheVersion {} {}>".format(self.name, self.version)
+
+
+# 按月分表日志的编号序列，各月分表共用，编号不因换月重新从 1 开始
+class IdSequence(db.Model):
+    __tablename__ = "idSequence"
+    name = db.Column(db.String(64), primary_key=True)  # 序列名称, 即日志的基础表名
+    value = db.Column(db.Integer, default=0)  # 已分配的最大编号
+
+    def __repr__(self):
+        return "<IdSequence {} {}>".format(self.name, self.value)
+
+
+# 数据库迁移版本
+class SchemaVersion(db.Model):
+    __tablename__ = "schemaVersion"
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 版本号
+    name = db.Column(db.String(255))  # 迁移说明
+    addtime = db.Column(db.DateTime, default=datetime.now)  # 执行时间
+
+    def __repr__(self):
+        return "<SchemaVersion {}>".format(self.version)
+
+
 # if __name__ == '__main__':
 #     # db.create_all()
 #     from werkzeug.security import generate_password_hash
@@ -0,0 +1,249 @@
+import os
+import struct
+
+# moov 中需要继续向下解析的容器 box
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts", b"dinf", b"mvex", b"udta"}
+
+# 复制文件时每次读取的字节数
+COPY_BUFFER = 1024 * 1024
+
+
+def read_boxes(f, end=None):
+    """
+    顺序读取顶层 box，返回 [(类型, 起始位置, 头长度, 总长度)]，结构不合法时返回 None
+    """
+    if end is None:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+    boxes = []
+    pos = 0
+    while pos < end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        size, kind = struct.unpack(">I4s", header)
+        header_len = 8
+        if size == 1:
+            large = f.read(8)
+            if len(large) < 8:
+                return None
+            size = struct.unpack(">Q", large)[0]
+            header_len = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_len or pos + size > end:
+            return None
+        boxes.append((kind, pos, header_len, size))
+        pos += size
+    return boxes
+
+
+def _parse(data):
+    """
+    把 moov 的内容解析成 [[类型, 子节点列表或数据]]
+    """
+    nodes = []
+    pos = 0
+    while pos + 8 <= len(data):
+        size, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        header_len = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[pos + 8:pos + 16])[0]
+            header_len = 16
+        elif size == 0:
+            size = len(data) - pos
+        if size < header_len or pos + size > len(data):
+            raise ValueError("bad box in moov")
+        body = data[pos + header_len:pos + size]
+        nodes.append([kind, _parse(body) if kind in CONTAINERS else body])
+        pos += size
+    return nodes
+
+
+def _serialize(nodes):
+    out = []
+    for kind, body in nodes:
+        if isinstance(body, list):
+            body = _serialize(body)
+        size = len(body) + 8
+        if size > 0xffffffff:
+            out.append(struct.pack(">I4sQ", 1, kind, size + 8))
+        else:
+            out.append(struct.pack(">I4s", size, kind))
+        out.append(body)
+    return b"".join(out)
+
+
+def _chunk_tables(nodes):
+    for node in nodes:
+        if isinstance(node[1], list):
+            for t in _chunk_tables(node[1]):
+                yield t
+        elif node[0] in (b"stco", b"co64"):
+            yield node
+
+
+def _offsets(node):
+    kind, body = node
+    count = struct.unpack(">I", body[4:8])[0]
+    fmt = ">{}{}".format(count, "I" if kind == b"stco" else "Q")
+    return list(struct.unpack(fmt, body[8:8 + struct.calcsize(fmt)]))
+
+
+def _set_offsets(node, kind, offsets):
+    fmt = ">{}{}".format(len(offsets), "I" if kind == b"stco" else "Q")
+    node[0] = kind
+    node[1] = node[1][:4] + struct.pack(">I", len(offsets)) + struct.pack(fmt, *offsets)
+
+
+def _copy(src, dst, start, length):
+    src.seek(start)
+    while length > 0:
+        data = src.read(min(COPY_BUFFER, length))
+        if not data:
+            raise ValueError("unexpected end of file")
+        dst.write(data)
+        length -= len(data)
+
+
+def faststart(path):
+    """
+    把 moov 移到 mdat 之前并修正 stco/co64 中的块偏移，只读入 moov，mdat 按块流式复制。
+    已经是 faststart、不是 MP4 或结构无法识别时不做修改，返回是否改写了文件
+    """
+    with open(path, "rb") as f:
+        boxes = read_boxes(f)
+        if not boxes or boxes[0][0] != b"ftyp":
+            return False
+        kinds = [b[0] for b in boxes]
+        if b"moov" not in kinds or b"mdat" not in kinds:
+            return False
+        moov = boxes[kinds.index(b"moov")]
+        mdat = boxes[kinds.index(b"mdat")]
+        if moov[1] < mdat[1]:
+            return False
+
+        f.seek(moov[1] + moov[2])
+        try:
+            nodes = _parse(f.read(moov[3] - moov[2]))
+        except (ValueError, struct.error):
+            return False
+        if any(kind == b"cmov" for kind, _ in nodes):
+            return False
+        tables = list(_chunk_tables(nodes))
+        originals = [_offsets(t) for t in tables]
+
+        moov_end = moov[1] + moov[3]
+        if any(moov[1] <= o < moov_end for offsets in originals for o in offsets):
+            return False
+
+        def relocate(o, size):
+            # moov 插入到第一个 mdat 之前：mdat 到原 moov 之间的数据后移新 moov 的长度，
+            # 原 moov 之后的数据再减去原 moov 的长度
+            if o < mdat[1]:
+                return o
+            if o < moov[1]:
+                return o + size
+            return o + size - moov[3]
+
+        # stco 放不下时改为 co64，moov 因此变长，需要重新计算
+        while True:
+            new_moov = _serialize([[b"moov", nodes]])
+            size = len(new_moov)
+            upgraded = False
+            for table, offsets in zip(tables, originals):
+                moved = [relocate(o, size) for o in offsets]
+                kind = table[0]
+                if kind == b"stco" and moved and max(moved) > 0xffffffff:
+                    kind = b"co64"
+                    upgraded = True
+                _set_offsets(table, kind, moved)
+            if not upgraded:
+                break
+        new_moov = _serialize([[b"moov", nodes]])
+
+        tmp = path + ".faststart"
+        try:
+            with open(tmp, "wb") as out:
+                _copy(f, out, 0, mdat[1])
+                out.write(new_moov)
+                _copy(f, out, mdat[1], moov[1] - mdat[1])
+                end = boxes[-1][1] + boxes[-1][3]
+                _copy(f, out, moov_end, end - moov_end)
+        except Exception:
+            os.remove(tmp)
+            raise
+    os.replace(tmp, path)
+    return True
+
+
+def _children(f, start, end):
+    """
+    只读 box 头，依次返回 (类型, 数据起始位置, 数据结束位置)
+    """
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack(">I4s", f.read(8))
+        header_len = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_len = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_len or pos + size > end:
+            return
+        yield kind, pos + header_len, pos + size
+        pos += size
+
+
+def probe(path):
+    """
+    从 mvhd/tkhd 读取时长(秒)、视频宽高和平均码率(kbps)，只读取这几个 box，
+    不是 MP4 或缺少 mvhd 时返回 None
+    """
+    with open(path, "rb") as f:
+        boxes = read_boxes(f)
+        if not boxes or boxes[0][0] != b"ftyp":
+            return None
+        moov = [b for b in boxes if b[0] == b"moov"]
+        if not moov:
+            return None
+        _, pos, header_len, size = moov[0]
+        file_size = boxes[-1][1] + boxes[-1][3]
+
+        duration = None
+        width = height = 0
+        for kind, start, end in _children(f, pos + header_len, pos + size):
+            if kind == b"mvhd":
+                f.seek(start)
+                body = f.read(min(end - start, 32))
+                if len(body) < 32:
+                    return None
+                if body[:1] == b"\x01":
+                    timescale, length = struct.unpack(">IQ", body[20:32])
+                else:
+                    timescale, length = struct.unpack(">II", body[12:20])
+                if timescale:
+                    duration = length / float(timescale)
+            elif kind == b"trak":
+                for sub, sub_start, sub_end in _children(f, start, end):
+                    if sub != b"tkhd":
+                        continue
+                    f.seek(sub_start)
+                    body = f.read(sub_end - sub_start)
+                    # 宽高是 tkhd 最后 8 字节的 16.16 定点数
+                    if len(body) < 84:
+                        continue
+                    w, h = struct.unpack(">II", body[-8:])
+                    if (w >> 16) * (h >> 16) > width * height:
+                        width, height = w >> 16, h >> 16
+    if duration is None:
+        return None
+    return dict(
+        duration=int(round(duration)),
+        width=width or None,
+        height=height or None,
+        bitrate=int(file_size * 8 / duration / 1000) if duration else None
+    )
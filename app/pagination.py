@@ -0,0 +1,131 @@
+import base64
+import datetime
+import json
+
+from sqlalchemy import and_, or_
+
+
+# 游标分页（keyset）：按排序键定位，不使用 COUNT(*) 与 OFFSET
+class KeysetPage(object):
+    """
+    游标分页结果
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _dump_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+    return value
+
+
+def _load_value(column, value):
+    """
+    还原游标中的值，类型与列不符时抛出 TypeError，避免把列表、字典等传入 SQL
+    """
+    if value is None:
+        return value
+    expected = column.type.python_type
+    if expected is datetime.datetime:
+        if not isinstance(value, str):
+            raise TypeError(value)
+        return datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S.%f")
+    if expected is float:
+        expected = (int, float)
+    if isinstance(value, bool) or not isinstance(value, expected):
+        raise TypeError(value)
+    return value
+
+
+def encode_cursor(direction, values):
+    raw = json.dumps([direction, [_dump_value(v) for v in values]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, order):
+    """
+    解析游标，格式不对或与当前排序不匹配时返回 (None, None)
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, values = json.loads(raw.decode("utf-8"))
+        if direction not in ("n", "p") or not isinstance(values, list) or len(values) != len(order):
+            return None, None
+        return direction, [_load_value(col, v) for (col, _), v in zip(order, values)]
+    except (ValueError, TypeError, NotImplementedError):
+        return None, None
+
+
+def _seek(order, values, reverse):
+    """
+    构造 (k1, k2, ...) 在排序意义上"之后"的条件，支持各列升降序混合
+    """
+    clauses = []
+    first, first_desc = order[0]
+    # 冗余的首列范围条件，便于优化器直接走 (k1, ..., id) 复合索引做范围扫描
+    if first_desc != reverse:
+        bound = first <= values[0]
+    else:
+        bound = first >= values[0]
+    for i, (col, desc) in enumerate(order):
+        if desc != reverse:
+            cond = col < values[i]
+        else:
+            cond = col > values[i]
+        eqs = [order[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*(eqs + [cond])))
+    return and_(bound, or_(*clauses))
+
+
+def keyset_query(query, order, values=None, reverse=False):
+    """
+    在 query 上加上定位条件与排序，values 为空表示从头开始
+    """
+    if values is not None:
+        query = query.filter(_seek(order, values, reverse))
+    return query.order_by(*[
+        col.desc() if desc != reverse else col.asc() for col, desc in order
+    ])
+
+
+def keyset_paginate(query, order, cursor=None, per_page=10):
+    """
+    order: [(column, desc), ...]，最后一列须唯一（通常为主键），作为排序的最终判定
+    cursor: 上一次返回的 next_cursor / prev_cursor，为空表示第一页
+    """
+    direction, values = (None, None)
+    if cursor:
+        direction, values = decode_cursor(cursor, order)
+
+    reverse = direction == "p"
+    query = keyset_query(query, order, values, reverse)
+
+    items = query.limit(per_page + 1).all()
+    more = len(items) > per_page
+    items = items[:per_page]
+    if reverse:
+        items.reverse()
+
+    def key(item):
+        return [getattr(item, col.key) for col, _ in order]
+
+    next_cursor = prev_cursor = None
+    if items:
+        # 向后翻：多取的一行说明还有下一页；经由上一页回来时，下一页一定存在
+        if (more and not reverse) or reverse:
+            next_cursor = encode_cursor("n", key(items[-1]))
+        if (more and reverse) or (values is not None and not reverse):
+            prev_cursor = encode_cursor("p", key(items[0]))
+    return KeysetPage(items, next_cursor, prev_cursor)
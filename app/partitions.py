@@ -0,0 +1,288 @@
+import re
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import Column, Index, MetaData, Table, func, inspect, select
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+
+from app import db
+from app.cache import LRUCache, bump_versions, shared_versions
+from app.models import Admin, AdminLog, IdSequence, LogDaily, OpLog, User, UserLog
+from app.pagination import KeysetPage, decode_cursor, encode_cursor, keyset_query
+
+# 按月分表的日志: 模型 -> (所属者列, 所属者模型, 模板中所属者的属性名)
+PARTITIONED = {
+    UserLog: ("user_id", User, "user"),
+    AdminLog: ("admin_id", Admin, "admin"),
+    OpLog: ("admin_id", Admin, "admin"),
+}
+
+# 分表所属的 MetaData，与模型的分开，db.create_all 不会创建它们
+_metadata = MetaData()
+_lock = threading.Lock()
+# 本进程已确认存在的分表名
+_created = set()
+
+# 已有分表的月份列表
+partition_cache = LRUCache(maxsize=1024, ttl=60)
+
+# 列表页中的所属者，只取编号和名称
+Owner = namedtuple("Owner", ["id", "name"])
+
+
+class LogEntry(object):
+    """
+    列表页中的一条日志，属性与对应的模型相同
+    """
+
+    def __init__(self, row, model):
+        owner, _, owner_attr = PARTITIONED[model]
+        for c in model.__table__.columns:
+            setattr(self, c.name, getattr(row, c.name))
+        name = row.owner_name
+        setattr(self, owner_attr, Owner(getattr(row, owner), name) if name is not None else None)
+
+
+def month_key(when):
+    return when.strftime("%Y%m")
+
+
+def _month_range(month):
+    start = datetime.strptime(month, "%Y%m")
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+def _months_before(month, n):
+    start = datetime.strptime(month, "%Y%m")
+    y, m = divmod(start.year * 12 + start.month - 1 - n, 12)
+    return "{:04d}{:02d}".format(y, m + 1)
+
+
+def partition_table(model, month):
+    """
+    某个月的分表，列与模型相同，不带外键；另建 addtime 和 (所属者, addtime) 索引。
+    编号不由各分表自增生成，写入时用 allocate_ids 从共用的序列分配
+    """
+    name = "{}_{}".format(model.__tablename__, month)
+    with _lock:
+        table = _metadata.tables.get(name)
+        if table is None:
+            owner = PARTITIONED[model][0]
+            table = Table(name, _metadata, *[
+                Column(c.name, c.type, primary_key=c.primary_key) for c in model.__table__.columns
+            ])
+            Index("ix_{}_addtime".format(name), table.c.addtime)
+            Index("ix_{}_{}_addtime".format(name, owner), table.c[owner], table.c.addtime)
+    return table
+
+
+def ensure_partition(bind, model, month):
+    """
+    按需创建分表，返回表对象
+    """
+    table = partition_table(model, month)
+    if table.name not in _created:
+        table.create(bind=bind, checkfirst=True)
+        _created.add(table.name)
+        _forget_months(model)
+    return table
+
+
+def max_id(conn, model):
+    """
+    基础表和各月分表中最大的编号
+    """
+    ids = [conn.execute(select([func.max(model.__table__.c.id)])).scalar()]
+    for month in partition_months(model):
+        table = partition_table(model, month)
+        ids.append(conn.execute(select([func.max(table.c.id)])).scalar())
+    return max(i or 0 for i in ids)
+
+
+def allocate_ids(conn, model, n):
+    """
+    从 idSequence 为模型的分表分配 n 个连续编号，返回第一个。在调用方的事务中执行，
+    序列行在事务结束前被锁定，各进程分到的编号不会重复
+    """
+    table = IdSequence.__table__
+    name = model.__tablename__
+    update = table.update().where(table.c.name == name).values(value=table.c.value + n)
+    if not conn.execute(update).rowcount:
+        try:
+            # 迁移前写入的日志没有序列行，按已有的最大编号补上
+            with conn.begin_nested():
+                conn.execute(table.insert().values(name=name, value=max_id(conn, model)))
+        except IntegrityError:
+            # 另一个进程同时插入了序列行
+            pass
+        conn.execute(update)
+    return conn.execute(select([table.c.value]).where(table.c.name == name)).scalar() - n + 1
+
+
+def partition_months(model, shared=False):
+    """
+    已有分表的月份，从新到旧。shared 为 True 时缓存键带上 cacheVersion 中的版本号，
+    其他进程执行 logs-rollup 删除分表后本进程随即重新读取（迁移中该表可能还不存在，默认不读）
+    """
+    version = 0
+    if shared:
+        name = "partitions:" + model.__tablename__
+        version = shared_versions(name)[name]
+    key = ("months", model.__tablename__, version)
+    months = partition_cache.get(key)
+    if months is None:
+        pattern = re.compile(r"^{}_(\d{{6}})$".format(re.escape(model.__tablename__)))
+        months = sorted(
+            (m.group(1) for m in map(pattern.match, inspect(db.engine).get_table_names()) if m),
+            reverse=True
+        )
+        partition_cache.set(key, months)
+    return months
+
+
+def _forget_months(model):
+    partition_cache.invalidate(lambda key: key[:2] == ("months", model.__tablename__))
+
+
+def _rows(model, month, owner_id, values, reverse, limit):
+    """
+    在一个分表内按 (addtime, id) 倒序做游标定位，values 为空表示从头开始
+    """
+    owner, owner_model, _ = PARTITIONED[model]
+    table = partition_table(model, month)
+    query = db.session.query(table, owner_model.name.label("owner_name")).select_from(table).outerjoin(
+        owner_model.__table__, owner_model.id == table.c[owner]
+    )
+    if owner_id is not None:
+        query = query.filter(table.c[owner] == owner_id)
+    order = [(table.c.addtime, True), (table.c.id, True)]
+    return keyset_query(query, order, values, reverse).limit(limit).all()
+
+
+def _log_page(model, direction, values, per_page, owner_id):
+    reverse = direction == "p"
+    months = partition_months(model, shared=True)
+    if values is not None:
+        # 只需查询游标所在月份及其之前（向前翻时为之后）的分表
+        current = month_key(values[0])
+        months = [m for m in months if (m >= current if reverse else m <= current)]
+    if reverse:
+        months = months[::-1]
+    rows = []
+    for month in months:
+        if len(rows) > per_page:
+            break
+        rows += _rows(model, month, owner_id, values, reverse, per_page + 1 - len(rows))
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if reverse:
+        rows.reverse()
+    items = [LogEntry(row, model) for row in rows]
+
+    next_cursor = prev_cursor = None
+    if items:
+        if more or reverse:
+            next_cursor = encode_cursor("n", [items[-1].addtime, items[-1].id])
+        if (more and reverse) or (values is not None and not reverse):
+            prev_cursor = encode_cursor("p", [items[0].addtime, items[0].id])
+    return KeysetPage(items, next_cursor, prev_cursor)
+
+
+def log_page(model, cursor=None, per_page=10, owner_id=None):
+    """
+    按时间倒序游标分页读取各月分表，不做 COUNT 与 OFFSET，
+    只查询游标所在月份起的分表，凑够一页即停止
+    """
+    direction, values = (None, None)
+    if cursor:
+        direction, values = decode_cursor(cursor, [(model.addtime, True), (model.id, True)])
+        if values is not None and values[0] is None:
+            direction, values = (None, None)
+    try:
+        return _log_page(model, direction, values, per_page, owner_id)
+    except (OperationalError, ProgrammingError):
+        # 月份列表读取后分表被 logs-rollup 删除：重新读取月份列表再查一次
+        db.session.rollback()
+        _forget_months(model)
+        return _log_page(model, direction, values, per_page, owner_id)
+
+
+def migrate_rows(conn, model):
+    """
+    把基础表中的日志按月复制到分表并清空基础表
+    """
+    base = model.__table__
+    low, high = conn.execute(select([func.min(base.c.addtime), func.max(base.c.addtime)])).fetchone()
+    has_null = conn.execute(select([func.count()]).select_from(base).where(base.c.addtime == None)).scalar()
+    if low is None:
+        if not has_null:
+            return
+        low = high = datetime.now()
+    if isinstance(low, str):
+        # SQLite 中的聚合结果不会被转换为 datetime
+        low, high = (datetime.strptime(v[:7], "%Y-%m") for v in (low, high))
+    columns = [c.name for c in base.columns]
+    month = month_key(low)
+    first = True
+    while month <= month_key(high):
+        start, end = _month_range(month)
+        where = (base.c.addtime >= start) & (base.c.addtime < end)
+        if first:
+            # 没有时间的旧记录放入最早的分表
+            where = where | (base.c.addtime == None)
+            first = False
+        table = ensure_partition(conn, model, month)
+        conn.execute(table.insert().from_select(
+            columns, select([base.c[c] for c in columns]).where(where)
+        ))
+        month = month_key(end)
+    conn.execute(base.delete())
+
+
+def rollup(months=None, dry_run=False):
+    """
+    把保留期（当月之前 months 个月）以外的分表按 (天, 所属者) 汇总到 logDaily 后删除分表。
+    汇总提交后才删除分表，中断后重新执行会先清除该月已有的汇总，不会重复计数。
+    逐个返回 (分表名, 原始行数, 汇总行数)，dry_run 时只统计不修改
+    """
+    months = months if months is not None else current_app.config.get("LOG_RETENTION_MONTHS", 3)
+    cutoff = _months_before(month_key(datetime.now()), months)
+    daily = LogDaily.__table__
+    for model, (owner, _, _) in PARTITIONED.items():
+        for month in partition_months(model):
+            if month >= cutoff:
+                continue
+            table = partition_table(model, month)
+            start, end = _month_range(month)
+            day = func.date(table.c.addtime)
+            with db.engine.begin() as conn:
+                rows = conn.execute(select([func.count()]).select_from(table)).scalar()
+                groups = conn.execute(
+                    select([day, table.c[owner], func.count()]).group_by(day, table.c[owner])
+                ).fetchall()
+                if not dry_run:
+                    conn.execute(daily.delete().where(
+                        (daily.c.log == model.__tablename__) &
+                        (daily.c.day >= start.date()) & (daily.c.day < end.date())
+                    ))
+                    if groups:
+                        conn.execute(daily.insert(), [
+                            dict(log=model.__tablename__, day=as_date(d), owner_id=o, count=n)
+                            for d, o, n in groups
+                        ])
+            if not dry_run:
+                table.drop(bind=db.engine, checkfirst=True)
+                _created.discard(table.name)
+                _forget_months(model)
+                bump_versions("partitions:" + model.__tablename__)
+            yield table.name, rows, len(groups)
+
+
+def as_date(value):
+    # SQLite 的 date() 返回字符串
+    if isinstance(value, str):
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    return value
@@ -0,0 +1,59 @@
+from app import db
+from app.cache import LRUCache, bump_versions, shared_versions
+from app.models import Auth, RoleAuth
+
+# (角色 id, 角色版本号, 权限版本号) -> 可访问的 URL 规则 frozenset；
+# 版本号存于 cacheVersion，每次检查权限都读取一次，任一进程提交修改后所有进程立即按新权限判断
+role_rules_cache = LRUCache()
+
+# 所有角色都能访问的规则
+ALWAYS_ALLOWED = ("/admin/",)
+
+
+def init_app(app):
+    role_rules_cache.maxsize = app.config.get("PERMISSION_CACHE_SIZE", 256)
+    role_rules_cache.ttl = app.config.get("PERMISSION_CACHE_TTL", 60)
+
+
+def compile_rules(role_id):
+    """
+    查询角色拥有的权限，返回 URL 规则 frozenset
+    """
+    urls = [url for url, in db.session.query(Auth.url).join(
+        RoleAuth, RoleAuth.auth_id == Auth.id
+    ).filter(
+        RoleAuth.role_id == role_id
+    )] if role_id is not None else []
+    return frozenset(urls + list(ALWAYS_ALLOWED))
+
+
+def _role_version(role_id):
+    return "permissions:role:{}".format(role_id)
+
+
+def role_rules(role_id):
+    """
+    角色可访问的 URL 规则，命中缓存时只查询一次版本号
+    """
+    names = (_role_version(role_id), "permissions:rules")
+    versions = shared_versions(*names)
+    key = (role_id,) + tuple(versions[name] for name in names)
+    rules = role_rules_cache.get(key)
+    if rules is None:
+        rules = compile_rules(role_id)
+        role_rules_cache.set(key, rules)
+    return rules
+
+
+def invalidate_role(role_id):
+    """
+    角色的权限修改或角色删除后调用
+    """
+    bump_versions(_role_version(role_id))
+
+
+def invalidate_rules():
+    """
+    权限的 URL 变化会影响所有角色
+    """
+    bump_versions("permissions:rules")
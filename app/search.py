@@ -0,0 +1,268 @@
+import re
+from collections import Counter
+
+from flask_sqlalchemy import Pagination
+from sqlalchemy import func, or_, select
+
+from app import db
+from app.models import Movie, SearchDelta, SearchTerm
+
+# 片名中的词权重
+TITLE_WEIGHT = 5
+
+# 中日韩文字，按重叠的双字切分
+CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+TOKEN_RE = re.compile("([{0}]+)|([^\\W_{0}]+)".format(CJK))
+
+
+def tokenize(text):
+    """
+    拉丁字母/数字等按词切分；中文按重叠双字切分，并补上每段的最后一个字，
+    这样任意单字都能以"某词的首字"或"某段的末字"的形式被找到
+    """
+    if not text:
+        return []
+    tokens = []
+    for cjk, word in TOKEN_RE.findall(text.lower()):
+        if word:
+            tokens.append(word[:64])
+            continue
+        tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        tokens.append(cjk[-1])
+    return tokens
+
+
+def query_tokens(text):
+    """
+    查询词：单个汉字的段保留为单字（前缀匹配），其余同 tokenize，去掉段末补的单字
+    """
+    if not text:
+        return []
+    tokens = []
+    for cjk, word in TOKEN_RE.findall(text.lower()):
+        if word:
+            tokens.append(word[:64])
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return list(set(tokens))
+
+
+def movie_tokens(title, info):
+    """
+    电影的 {词: 权重}
+    """
+    weights = Counter()
+    for t in tokenize(title):
+        weights[t] += TITLE_WEIGHT
+    for t in tokenize(info):
+        weights[t] += 1
+    return weights
+
+
+# 倒排表编码：按电影 id 升序，每项为 (id 差值, 权重) 两个 varint
+def encode_postings(postings):
+    out = bytearray()
+    last = 0
+    for movie_id, weight in postings:
+        for n in (movie_id - last, weight):
+            while n >= 0x80:
+                out.append((n & 0x7f) | 0x80)
+                n >>= 7
+            out.append(n)
+        last = movie_id
+    return bytes(out)
+
+
+def decode_postings(data):
+    postings = []
+    nums = []
+    n = shift = 0
+    for b in bytearray(data or b""):
+        n |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        nums.append(n)
+        n = shift = 0
+    last = 0
+    for i in range(0, len(nums) - 1, 2):
+        last += nums[i]
+        postings.append((last, nums[i + 1]))
+    return postings
+
+
+def _update_terms(movie_id, remove=None, add=None):
+    """
+    从 remove 的词中去掉这部电影，再按 add 的 {词: 权重} 加入，在调用方的事务中执行。
+    只追加增量行，不读取也不锁定倒排表，写入量只与这部电影的词数有关
+    """
+    remove = remove or {}
+    add = add or {}
+    rows = [dict(token=t, movie_id=movie_id, weight=0) for t in remove if t not in add]
+    rows += [dict(token=t, movie_id=movie_id, weight=w) for t, w in add.items() if remove.get(t) != w]
+    if rows:
+        db.session.execute(SearchDelta.__table__.insert(), rows)
+
+
+def _apply(postings, deltas):
+    # 按顺序把 [(电影 id, 权重)] 增量应用到 {电影 id: 权重}
+    for movie_id, weight in deltas:
+        if weight:
+            postings[movie_id] = weight
+        else:
+            postings.pop(movie_id, None)
+    return postings
+
+
+def index_movie(movie, old=None):
+    """
+    (重新)索引一部电影，电影须已有 id；编辑时 old 为修改前的 (片名, 简介)
+    """
+    remove = movie_tokens(*old) if old else None
+    _update_terms(movie.id, remove=remove, add=movie_tokens(movie.title, movie.info))
+
+
+def unindex_movie(movie):
+    _update_terms(movie.id, remove=movie_tokens(movie.title, movie.info))
+
+
+def compact_index(conn, batch=500):
+    """
+    把增量合并进各词的倒排表并删除已合并的增量，返回合并的词数。
+    先锁定增量行再锁定倒排表，同时执行的合并不会重复应用同一批增量
+    """
+    delta = SearchDelta.__table__
+    term = SearchTerm.__table__
+    tokens = [t for t, in conn.execute(select([delta.c.token]).distinct())]
+    for i in range(0, len(tokens), batch):
+        chunk = tokens[i:i + batch]
+        rows = conn.execute(
+            select([delta.c.id, delta.c.token, delta.c.movie_id, delta.c.weight]).where(
+                delta.c.token.in_(chunk)
+            ).order_by(delta.c.id).with_for_update()
+        ).fetchall()
+        if not rows:
+            continue
+        changes = {}
+        for _, token, movie_id, weight in rows:
+            changes.setdefault(token, []).append((movie_id, weight))
+        terms = dict(conn.execute(
+            select([term.c.token, term.c.postings]).where(term.c.token.in_(list(changes))).with_for_update()
+        ).fetchall())
+        for token, deltas in changes.items():
+            postings = _apply(dict(decode_postings(terms.get(token))), deltas)
+            values = dict(df=len(postings), postings=encode_postings(sorted(postings.items())))
+            if token not in terms:
+                if postings:
+                    conn.execute(term.insert().values(token=token, **values))
+            elif postings:
+                conn.execute(term.update().where(term.c.token == token).values(**values))
+            else:
+                conn.execute(term.delete().where(term.c.token == token))
+        conn.execute(delta.delete().where(delta.c.id.in_([r[0] for r in rows])))
+    return len(tokens)
+
+
+def rebuild_index(conn, batch=500):
+    """
+    在给定连接上重建全部电影的索引，按 id 分批读取后在内存中汇总成倒排表；
+    开始之前已有的增量随之作废，重建期间新写入的保留
+    """
+    movie = Movie.__table__
+    delta = SearchDelta.__table__
+    last_delta = conn.execute(select([func.max(delta.c.id)])).scalar()
+    index = {}
+    last_id = 0
+    while True:
+        movies = conn.execute(
+            select([movie.c.id, movie.c.title, movie.c.info]).where(
+                movie.c.id > last_id
+            ).order_by(movie.c.id).limit(batch)
+        ).fetchall()
+        if not movies:
+            break
+        for m in movies:
+            for t, w in movie_tokens(m.title, m.info).items():
+                index.setdefault(t, []).append((m.id, w))
+        last_id = movies[-1].id
+
+    conn.execute(SearchTerm.__table__.delete())
+    if last_delta is not None:
+        conn.execute(delta.delete().where(delta.c.id <= last_delta))
+    rows = [dict(token=t, df=len(p), postings=encode_postings(p)) for t, p in index.items()]
+    for i in range(0, len(rows), batch):
+        conn.execute(SearchTerm.__table__.insert(), rows[i:i + batch])
+
+
+def _intersect(lists):
+    """
+    按 id 有序的倒排表求交集并累加权重，从最短的表开始
+    """
+    lists = sorted(lists, key=len)
+    result = lists[0]
+    for other in lists[1:]:
+        merged = []
+        i = j = 0
+        while i < len(result) and j < len(other):
+            a, b = result[i][0], other[j][0]
+            if a == b:
+                merged.append((a, result[i][1] + other[j][1]))
+                i += 1
+                j += 1
+            elif a < b:
+                i += 1
+            else:
+                j += 1
+        result = merged
+        if not result:
+            break
+    return result
+
+
+def search_movies(key, page=1, per_page=10):
+    """
+    包含全部查询词的电影，按权重和排序；命中总数与排序在同一次倒排表合并中得到
+    """
+    tokens = query_tokens(key)
+    if not tokens:
+        return Movie.query.order_by(
+            Movie.addtime.desc()
+        ).paginate(page=page, per_page=per_page)
+
+    # 单个汉字按前缀匹配双字词
+    def is_prefix(t):
+        return len(t) == 1 and bool(TOKEN_RE.match(t).group(1))
+
+    def match(column):
+        conds = []
+        for t in tokens:
+            if is_prefix(t):
+                conds.append(or_(column == t, column.like(t + "_")))
+            else:
+                conds.append(column == t)
+        return or_(*conds)
+
+    # 各词的倒排表加上尚未合并的增量
+    postings = dict(
+        (term.token, dict(decode_postings(term.postings)))
+        for term in SearchTerm.query.filter(match(SearchTerm.token))
+    )
+    for d in SearchDelta.query.filter(match(SearchDelta.token)).order_by(SearchDelta.id):
+        _apply(postings.setdefault(d.token, {}), [(d.movie_id, d.weight)])
+
+    lists = []
+    for t in tokens:
+        merged = Counter()
+        for token, p in postings.items():
+            if token == t or (is_prefix(t) and token[:1] == t):
+                merged.update(p)
+        lists.append(sorted(merged.items()))
+    hits = _intersect(lists) if all(lists) else []
+    hits.sort(key=lambda h: (-h[1], -h[0]))
+
+    ids = [h[0] for h in hits[(page - 1) * per_page:page * per_page]]
+    movies = dict((m.id, m) for m in Movie.query.filter(Movie.id.in_(ids))) if ids else {}
+    items = [movies[i] for i in ids if i in movies]
+    return Pagination(None, page, per_page, len(hits), items)
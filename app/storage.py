@@ -0,0 +1,406 @@
+import hashlib
+import os
+import re
+import shutil
+import stat
+import time
+import uuid
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from app import db
+from app.images import KINDS, derivative_name, mark_derivatives, remove_derivatives
+from app.models import Blob, Movie, Preview, User
+
+# 每次从上传流/文件读取的字节数
+READ_BUFFER = 64 * 1024
+
+# 引用上传文件的列: (模型, 列名, 存储目录配置项, 缩略图类别)
+FILE_COLUMNS = [
+    (Movie, "url", "UP_DIR", None),
+    (Movie, "cover", "UP_DIR", "cover"),
+    (Preview, "cover", "UP_DIR", "cover"),
+    (User, "avatar", "USER_DIR", "avatar"),
+]
+
+# 缩略图文件名（不含扩展名）的后缀，如 "_262"
+DERIVATIVE_RE = re.compile(r"^(.*)_\d+$")
+
+
+def blob_name(digest, ext):
+    """
+    按摘要前两级各 256 个子目录分片，如 "ab/cd/abcd....jpg"
+    """
+    return "{}/{}/{}{}".format(digest[:2], digest[2:4], digest, ext.lower())
+
+
+def temp_path(root="UP_DIR"):
+    """
+    与存储目录同一文件系统下的临时文件路径，写完后可以原子改名
+    """
+    directory = current_app.config[root]
+    if not os.path.isdir(directory):
+        # 创建一个多级目录
+        os.makedirs(directory, exist_ok=True)
+        os.chmod(directory, stat.S_IRWXU)
+    return os.path.join(directory, ".{}.tmp".format(uuid.uuid4().hex))
+
+
+def _digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(READ_BUFFER)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _incr(root, name):
+    table = Blob.__table__
+    result = db.session.execute(
+        table.update().where(
+            (table.c.root == root) & (table.c.name == name)
+        ).values(refcount=table.c.refcount + 1)
+    )
+    return result.rowcount > 0
+
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # 不支持硬链接（如跨文件系统）时复制
+        tmp = dst + ".tmp"
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+
+
+def _touch(path):
+    """
+    刷新垃圾回收的宽限期。硬链接的文件与外部文件共用 inode，
+    不修改其 mtime，只用不改变权限的 chmod 更新 ctime
+    """
+    st = os.stat(path)
+    if st.st_nlink > 1:
+        os.chmod(path, stat.S_IMODE(st.st_mode))
+    else:
+        os.utime(path, None)
+
+
+def _store(src, digest, ext, root, keep=False):
+    name = blob_name(digest, ext)
+    path = current_app.config[root] + name
+    size = os.path.getsize(src)
+    if not _incr(root, name):
+        try:
+            with db.session.begin_nested():
+                db.session.add(Blob(root=root, name=name, size=size, refcount=1))
+        except IntegrityError:
+            # 同一内容被并发上传，对方已经插入记录
+            _incr(root, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if keep:
+            _link(src, path)
+        else:
+            os.replace(src, path)
+    else:
+        # 垃圾回收的宽限期从最后一次被引用算起
+        _touch(path)
+    return name
+
+
+def put(tmp, ext, root="UP_DIR", digest=None):
+    """
+    把已写好的临时文件按内容存入 root 目录，同内容只保留一份并增加引用数，返回存储名。
+    digest 为写入时已算好的 sha256，给出时不再读取文件
+    """
+    try:
+        return _store(tmp, digest or _digest(tmp), ext, root)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def save(file, root="UP_DIR"):
+    """
+    边写入边计算摘要地保存上传的 FileStorage，返回存储名
+    """
+    ext = os.path.splitext(secure_filename(file.filename or ""))[1]
+    tmp = temp_path(root)
+    digest = hashlib.sha256()
+    try:
+        with open(tmp, "wb") as f:
+            while True:
+                data = file.stream.read(READ_BUFFER)
+                if not data:
+                    break
+                digest.update(data)
+                f.write(data)
+        return _store(tmp, digest.hexdigest(), ext, root)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def rewrite(name, prepare, root="UP_DIR"):
+    """
+    在已存储文件的副本上执行 prepare(path)；改写了内容时按新内容存储并返回新存储名（引用数加一），
+    否则返回 None。原文件保持不变，仍被其他记录引用时不受影响
+    """
+    tmp = temp_path(root)
+    try:
+        _link(current_app.config[root] + name, tmp)
+        if not prepare(tmp):
+            return None
+        return _store(tmp, _digest(tmp), os.path.splitext(name)[1], root)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def release(name, root="UP_DIR"):
+    """
+    减少一个引用，返回是否已无引用；与调用方的改动一起提交后再用 unlink 删除文件。
+    没有记录的旧文件视为只有一个引用
+    """
+    if not name:
+        return False
+    table = Blob.__table__
+    where = (table.c.root == root) & (table.c.name == name)
+    result = db.session.execute(
+        table.update().where(where).values(refcount=table.c.refcount - 1)
+    )
+    if result.rowcount == 0:
+        return True
+    result = db.session.execute(table.delete().where(where & (table.c.refcount <= 0)))
+    return result.rowcount > 0
+
+
+def unlink(name, root="UP_DIR", kind=None):
+    """
+    删除已无引用的文件（kind 不为空时连同缩略图），返回是否删除。
+    先锁定该文件的 blob 记录再检查：release 之后同一内容又被上传、记录重新有了引用时不删除；
+    删除文件后才提交，并发的上传在锁释放后会发现文件不存在而重新写入
+    """
+    table = Blob.__table__
+    live = db.session.execute(select([table.c.id]).where(
+        (table.c.root == root) & (table.c.name == name) & (table.c.refcount > 0)
+    ).with_for_update()).first()
+    try:
+        if live is not None:
+            return False
+        path = current_app.config[root] + name
+        if os.path.exists(path):
+            os.remove(path)
+        if kind is not None:
+            remove_derivatives(name, kind)
+        return True
+    finally:
+        db.session.commit()
+
+
+def ingest(path, root="UP_DIR", link=False):
+    """
+    只处理文件：把外部文件按内容复制（link 时硬链接）到分片目录，返回 (存储名, 大小)。
+    不访问数据库，可以在线程池中并行执行，引用数由调用方用 add_refs 登记；
+    在登记之前新文件靠 mtime/ctime 落在垃圾回收的宽限期内
+    """
+    name = blob_name(_digest(path), os.path.splitext(path)[1])
+    dst = current_app.config[root] + name
+    if os.path.exists(dst):
+        _touch(dst)
+    else:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = temp_path(root)
+        try:
+            if link:
+                # 硬链接保留原文件的 mtime，链接本身会更新 ctime
+                _link(path, tmp)
+            else:
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, dst)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return name, os.path.getsize(dst)
+
+
+def add_refs(refs, sizes, root="UP_DIR"):
+    """
+    批量增加引用数，refs 为 {存储名: 增加数}，没有记录的按 sizes 中的大小新建
+    """
+    if not refs:
+        return
+    table = Blob.__table__
+    existing = set(n for n, in db.session.query(table.c.name).filter(
+        table.c.root == root, table.c.name.in_(list(refs))
+    ))
+    if existing:
+        db.session.execute(
+            table.update().where(
+                (table.c.root == root) & (table.c.name == bindparam("b_name"))
+            ).values(refcount=table.c.refcount + bindparam("b_n")),
+            [dict(b_name=n, b_n=refs[n]) for n in existing]
+        )
+    new = [
+        dict(root=root, name=n, size=sizes[n], refcount=k, addtime=datetime.now())
+        for n, k in refs.items() if n not in existing
+    ]
+    if new:
+        db.session.execute(table.insert(), new)
+
+
+def adopt(path, root="UP_DIR"):
+    """
+    把已在磁盘上的文件按内容登记到存储中并增加引用数，原文件保留不动，返回存储名
+    """
+    return _store(path, _digest(path), os.path.splitext(path)[1], root, keep=True)
+
+
+def _link_derivatives(old, new, root, kind):
+    """
+    把旧文件的缩略图链接到新存储名下，全部存在时在 blob 中记录
+    """
+    if kind is None:
+        return
+    directory = current_app.config[root]
+    complete = True
+    for size in KINDS[kind][1]:
+        for ext in (None, ".webp"):
+            src = directory + derivative_name(old, size, ext)
+            dst = directory + derivative_name(new, size, ext)
+            if os.path.exists(src) and not os.path.exists(dst):
+                _link(src, dst)
+            complete = complete and os.path.exists(dst)
+    if complete:
+        mark_derivatives(new, kind)
+
+
+def migrate_flat(batch=500, keep=False):
+    """
+    把平铺在上传目录中的旧文件按内容迁入分片目录并改写引用它的列，每批提交一次。
+    新位置先以硬链接建立，提交后才删除旧文件（keep 时保留），迁移期间新旧地址都可访问；
+    已迁移的行不再匹配，中断后重新执行即从剩余的行继续。
+    返回 [(表名.列名, 迁移数, 文件缺失数)]
+    """
+    stats = []
+    for model, column, root, kind in FILE_COLUMNS:
+        table = model.__table__
+        col = table.c[column]
+        moved = missing = 0
+        last = 0
+        while True:
+            rows = db.session.query(table.c.id, col).filter(
+                table.c.id > last, col != None, col != "", ~col.contains("/")
+            ).order_by(table.c.id).limit(batch).all()
+            if not rows:
+                break
+            last = rows[-1][0]
+            done, dead = [], []
+            for row_id, old in rows:
+                path = current_app.config[root] + old
+                if not os.path.isfile(path):
+                    missing += 1
+                    continue
+                new = adopt(path, root)
+                _link_derivatives(old, new, root, kind)
+                # 只改写迁移期间没有被修改过的行
+                changed = db.session.execute(
+                    table.update().where((table.c.id == row_id) & (col == old)).values({column: new})
+                ).rowcount
+                if changed:
+                    done.append(old)
+                elif release(new, root):
+                    dead.append(new)
+            db.session.commit()
+            moved += len(done)
+            for name in dead:
+                unlink(name, root, kind)
+            if not keep:
+                for name in done:
+                    unlink(name, root, kind)
+        stats.append(("{}.{}".format(table.name, column), moved, missing))
+    return stats
+
+
+def _referenced(root):
+    """
+    root 目录下被数据库引用的文件名（不含扩展名）集合
+    """
+    stems = set()
+    for model, column, col_root, _ in FILE_COLUMNS:
+        if col_root != root:
+            continue
+        col = model.__table__.c[column]
+        for name, in db.session.query(col).filter(col != None, col != "").yield_per(1000):
+            stems.add(os.path.splitext(name)[0])
+    return stems
+
+
+def _scan(directory, skip):
+    """
+    逐个返回目录树下的文件，跳过以 . 开头的目录（如分块上传目录）和 skip 中的目录
+    """
+    for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            if entry.name.startswith(".") or os.path.realpath(entry.path) in skip:
+                continue
+            for sub in _scan(entry.path, skip):
+                yield sub
+        elif entry.is_file(follow_symlinks=False):
+            yield entry
+
+
+def _delete_blobs(root, names):
+    table = Blob.__table__
+    db.session.execute(table.delete().where((table.c.root == root) & table.c.name.in_(names)))
+    db.session.commit()
+
+
+def collect_garbage(grace=None, dry_run=False, batch=500):
+    """
+    删除上传目录中没有被任何记录引用、且超过 grace 秒未修改的文件（含缩略图和残留的临时文件），
+    同时删除对应的 blob 记录。内存中只保存被引用的文件名集合，目录逐项扫描。
+    逐个返回 (路径, 大小)，dry_run 时只列出不删除
+    """
+    grace = grace if grace is not None else current_app.config.get("UPLOAD_GC_GRACE", 86400)
+    deadline = time.time() - grace
+    roots = sorted(set(r for _, _, r, _ in FILE_COLUMNS))
+    directories = dict((r, os.path.realpath(current_app.config[r])) for r in roots)
+    for root in roots:
+        directory = directories[root]
+        if not os.path.isdir(directory):
+            continue
+        stems = _referenced(root)
+        # 其他存储目录可能嵌套在当前目录下（如 USER_DIR 在 UP_DIR 中）
+        skip = set(d for r, d in directories.items() if r != root)
+        names = []
+        for entry in _scan(directory, skip):
+            name = os.path.relpath(entry.path, directory).replace(os.sep, "/")
+            stem = os.path.splitext(name)[0]
+            if stem in stems:
+                continue
+            m = DERIVATIVE_RE.match(stem)
+            if m and m.group(1) in stems:
+                continue
+            st = entry.stat(follow_symlinks=False)
+            # 硬链接导入的文件保留外部文件的 mtime，链接时更新的是 ctime
+            if max(st.st_mtime, st.st_ctime) > deadline:
+                continue
+            yield entry.path, st.st_size
+            if dry_run:
+                continue
+            os.remove(entry.path)
+            names.append(name)
+            if len(names) >= batch:
+                _delete_blobs(root, names)
+                names = []
+        if names:
+            _delete_blobs(root, names)
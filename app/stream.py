@@ -0,0 +1,80 @@
+import calendar
+import mimetypes
+import os
+
+from flask import Response, abort, current_app, request
+from werkzeug.http import http_date, parse_date
+
+
+# 非 sendfile 情况下每次读取的字节数
+BUFFER_SIZE = 64 * 1024
+
+
+def _read_range(f, length, buffer_size):
+    try:
+        while length > 0:
+            data = f.read(min(buffer_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def send_media(path, buffer_size=BUFFER_SIZE):
+    """
+    发送大文件，支持单个 Range（206/416）、ETag/If-None-Match/If-Range；
+    读到文件末尾的范围交给服务器的 wsgi.file_wrapper（如 gunicorn 的 sendfile），其余按固定大小分块读取
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        abort(404)
+    size = st.st_size
+    etag = '"{:x}-{:x}"'.format(int(st.st_mtime * 1000000), size)
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": http_date(st.st_mtime),
+        "Cache-Control": "public, max-age={}".format(current_app.config.get("MEDIA_MAX_AGE", 86400)),
+    }
+
+    if request.if_none_match.contains_raw(etag):
+        return Response(status=304, headers=headers)
+
+    start, stop, status = 0, size, 200
+    rng = request.range
+    if_range = request.headers.get("If-Range")
+    if if_range:
+        # If-Range 与当前文件不一致时忽略 Range，返回整个文件
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            fresh = if_range == etag
+        else:
+            since = parse_date(if_range)
+            fresh = since is not None and int(st.st_mtime) <= calendar.timegm(since.utctimetuple())
+        if not fresh:
+            rng = None
+    if rng is not None and rng.units == "bytes" and len(rng.ranges) == 1:
+        r = rng.range_for_length(size)
+        if r is None:
+            headers["Content-Range"] = "bytes */{}".format(size)
+            return Response(status=416, headers=headers)
+        start, stop = r
+        status = 206
+        headers["Content-Range"] = "bytes {}-{}/{}".format(start, stop - 1, size)
+
+    length = stop - start
+    headers["Content-Length"] = str(length)
+    if request.method == "HEAD":
+        return Response(status=status, headers=headers, mimetype=mimetype)
+
+    f = open(path, "rb")
+    f.seek(start)
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is not None and stop == size:
+        body = file_wrapper(f, buffer_size)
+    else:
+        body = _read_range(f, length, buffer_size)
+    return Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
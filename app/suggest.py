@@ -0,0 +1,146 @@
+import bisect
+import heapq
+import threading
+import time
+
+from app import db
+from app.cache import LRUCache, bump_versions, recent_versions
+from app.models import Movie
+
+
+class TitleIndex(object):
+    """
+    片名前缀补全：按小写片名排序的数组上二分查找前缀区间，区间内按播放量取前 N 个。
+    首次使用时从数据库构建；电影增删改后 cacheVersion 中的 suggest 版本号加一，
+    各进程发现版本变化（或距上次构建超过 rebuild 秒）时在后台线程重建，建好后整体替换，
+    重建期间请求继续使用旧数组
+    """
+
+    def __init__(self, limit=10, rebuild=300):
+        self.limit = limit
+        self.rebuild = rebuild
+        self.app = None
+        self._keys = []  # [(小写片名, id)]，有序
+        self._movies = {}  # id -> (小写片名, 播放量, 片名)
+        self._version = None  # 当前数组对应的版本号，None 表示尚未构建
+        self._built = 0
+        self._gen = 0  # 数组每次变化加一，作为结果缓存键的一部分
+        self._building = False
+        self._results = LRUCache(maxsize=4096, ttl=rebuild)
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        self.app = app
+        self.limit = app.config.get("SUGGEST_LIMIT", self.limit)
+        self.rebuild = app.config.get("SUGGEST_REBUILD", self.rebuild)
+        self._results.ttl = self.rebuild
+
+    def _load(self):
+        movies = {}
+        for m_id, title, play_num in Movie.query.with_entities(
+                Movie.id, Movie.title, Movie.play_num
+        ):
+            movies[m_id] = ((title or "").lower(), play_num or 0, title or "")
+        return movies, sorted((v[0], k) for k, v in movies.items())
+
+    def _swap(self, version, movies, keys):
+        with self._lock:
+            self._movies, self._keys = movies, keys
+            self._version = version
+            self._built = time.time()
+            self._gen += 1
+            self._results.clear()
+
+    def _rebuild(self, version):
+        try:
+            with self.app.app_context():
+                movies, keys = self._load()
+                self._swap(version, movies, keys)
+                db.session.remove()
+        except Exception:
+            self.app.logger.exception("suggest: rebuild failed")
+        finally:
+            self._building = False
+
+    def _ensure_built(self):
+        version = recent_versions("suggest")["suggest"]
+        if self._version is None:
+            # 首次使用只能同步构建
+            with self._lock:
+                if self._version is None:
+                    movies, keys = self._load()
+                    self._swap(version, movies, keys)
+            return
+        if self._version == version and self._built + self.rebuild > time.time():
+            return
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        t = threading.Thread(target=self._rebuild, args=(version,), name="suggest-rebuild")
+        t.daemon = True
+        t.start()
+
+    def _remove(self, movie_id):
+        old = self._movies.pop(movie_id, None)
+        if old is not None:
+            i = bisect.bisect_left(self._keys, (old[0], movie_id))
+            if i < len(self._keys) and self._keys[i] == (old[0], movie_id):
+                del self._keys[i]
+
+    def put(self, movie):
+        """
+        新增或修改了一部电影：本进程立即更新，其他进程按版本号重建
+        """
+        bump_versions("suggest")
+        if self._version is None:
+            return
+        with self._lock:
+            self._remove(movie.id)
+            key = (movie.title or "").lower()
+            self._movies[movie.id] = (key, movie.play_num or 0, movie.title or "")
+            bisect.insort(self._keys, (key, movie.id))
+            self._gen += 1
+
+    def remove(self, movie_id):
+        """
+        删除了一部电影：本进程立即更新，其他进程按版本号重建
+        """
+        bump_versions("suggest")
+        if self._version is None:
+            return
+        with self._lock:
+            self._remove(movie_id)
+            self._gen += 1
+
+    def complete(self, prefix):
+        """
+        返回 [(id, 片名)]，按播放量从高到低
+        """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        self._ensure_built()
+        key = (self._gen, prefix)
+        result = self._results.get(key)
+        if result is not None:
+            return result
+        with self._lock:
+            key = (self._gen, prefix)
+            lo = bisect.bisect_left(self._keys, (prefix,))
+            hi = bisect.bisect_left(self._keys, (prefix + "\uffff",))
+            top = heapq.nlargest(
+                self.limit,
+                (self._keys[i][1] for i in range(lo, hi)),
+                key=lambda m_id: self._movies[m_id][1]
+            )
+            result = [(m_id, self._movies[m_id][2]) for m_id in top]
+        self._results.set(key, result)
+        return result
+
+
+title_index = TitleIndex()
+
+
+def init_app(app):
+    title_index.init_app(app)
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+from flask import current_app
+
+# 每次从请求/分块文件读取的字节数
+READ_BUFFER = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadBusy(UploadError):
+    """
+    同一上传正在由另一个请求完成
+    """
+    pass
+
+
+# 完成上传时把分块目录改名加上这个后缀，改名是原子操作，同一上传只有一个请求能完成
+COMPLETING = ".completing"
+
+
+def _root():
+    return current_app.config.get("CHUNK_DIR", current_app.config["UP_DIR"] + ".chunks/")
+
+
+def _dir(upload_id):
+    # upload_id 只能是 init 生成的 32 位十六进制串
+    if len(upload_id) != 32 or any(c not in "0123456789abcdef" for c in upload_id):
+        raise UploadError("上传不存在！")
+    return os.path.join(_root(), upload_id)
+
+
+def _meta(upload_id, path=None):
+    try:
+        with open(os.path.join(path or _dir(upload_id), "meta.json")) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        raise UploadError("上传不存在或已过期！")
+
+
+def _expected_length(meta, index):
+    if index == meta["chunks"] - 1:
+        return meta["size"] - index * meta["chunk_size"]
+    return meta["chunk_size"]
+
+
+def cleanup(expire=None):
+    """
+    删除超过 expire 秒未完成的上传
+    """
+    expire = expire if expire is not None else current_app.config.get("UPLOAD_EXPIRE", 86400)
+    root = _root()
+    if not os.path.isdir(root):
+        return
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and os.path.getmtime(path) + expire < now:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def init(filename, size, chunk_size=None):
+    """
+    开始一次分块上传，返回上传状态
+    """
+    max_chunk = current_app.config.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024)
+    chunk_size = min(int(chunk_size or max_chunk), max_chunk)
+    size = int(size)
+    if size <= 0 or chunk_size <= 0:
+        raise UploadError("文件大小不正确！")
+    cleanup()
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(_root(), upload_id)
+    os.makedirs(path)
+    meta = dict(
+        filename=filename,
+        size=size,
+        chunk_size=chunk_size,
+        chunks=(size + chunk_size - 1) // chunk_size
+    )
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return status(upload_id)
+
+
+def status(upload_id):
+    """
+    上传状态，received 为已收到的分块序号，用于断点续传
+    """
+    meta = _meta(upload_id)
+    path = _dir(upload_id)
+    received = sorted(
+        int(name[:-5]) for name in os.listdir(path) if name.endswith(".part")
+    )
+    return dict(
+        upload_id=upload_id,
+        filename=meta["filename"],
+        size=meta["size"],
+        chunk_size=meta["chunk_size"],
+        chunks=meta["chunks"],
+        received=received
+    )
+
+
+def save_chunk(upload_id, index, stream, md5):
+    """
+    从 stream 流式写入第 index 块并校验长度和 md5，分块可以任意顺序、重复上传
+    """
+    meta = _meta(upload_id)
+    if not 0 <= index < meta["chunks"]:
+        raise UploadError("分块序号不正确！")
+    expected = _expected_length(meta, index)
+    path = os.path.join(_dir(upload_id), "{}.part".format(index))
+    tmp = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+    digest = hashlib.md5()
+    length = 0
+    try:
+        with open(tmp, "wb") as f:
+            while True:
+                data = stream.read(READ_BUFFER)
+                if not data:
+                    break
+                length += len(data)
+                if length > expected:
+                    raise UploadError("分块大小不正确！")
+                digest.update(data)
+                f.write(data)
+        if length != expected:
+            raise UploadError("分块大小不正确！")
+        if digest.hexdigest() != (md5 or "").lower():
+            raise UploadError("分块校验失败！")
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    # 刷新目录时间，避免进行中的上传被当作过期清理
+    os.utime(_dir(upload_id), None)
+
+
+def assemble(upload_id, target):
+    """
+    按序号把全部分块拼接到 target，返回 (meta, 分块目录)。
+    先把分块目录改名占用，同时完成同一上传的请求得到 UploadBusy；
+    拼接失败时恢复目录，成功时目录保留，调用方保存完毕后用 finish 删除、失败时用 restore 恢复，
+    客户端可以重试。拼接时同时计算 sha256，存入 meta["sha256"]，存储时不必再读一遍文件
+    """
+    path = _dir(upload_id)
+    claimed = path + COMPLETING
+    try:
+        os.rename(path, claimed)
+    except OSError:
+        if os.path.isdir(claimed):
+            raise UploadBusy("上传正在完成中！")
+        raise UploadError("上传不存在或已过期！")
+    # 改名不更新目录的修改时间，避免完成中的上传被当作过期清理
+    os.utime(claimed, None)
+    tmp = target + ".uploading"
+    try:
+        meta = _meta(upload_id, claimed)
+        received = set(int(name[:-5]) for name in os.listdir(claimed) if name.endswith(".part"))
+        missing = [i for i in range(meta["chunks"]) if i not in received]
+        if missing:
+            raise UploadError("还有 {} 个分块未上传！".format(len(missing)))
+        digest = hashlib.sha256()
+        with open(tmp, "wb") as out:
+            for i in range(meta["chunks"]):
+                with open(os.path.join(claimed, "{}.part".format(i)), "rb") as f:
+                    while True:
+                        data = f.read(READ_BUFFER)
+                        if not data:
+                            break
+                        digest.update(data)
+                        out.write(data)
+        if os.path.getsize(tmp) != meta["size"]:
+            raise UploadError("文件大小不正确！")
+        os.replace(tmp, target)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        restore(claimed)
+        raise
+    meta["sha256"] = digest.hexdigest()
+    return meta, claimed
+
+
+def restore(path):
+    """
+    完成失败时恢复 assemble 占用的分块目录，客户端可以重新完成
+    """
+    os.rename(path, path[:-len(COMPLETING)])
+
+
+def finish(path):
+    """
+    文件和记录都已保存后删除 assemble 占用的分块目录
+    """
+    shutil.rmtree(path, ignore_errors=True)
@@ -1,4 +1,146 @@
-from app import app
+import os
+
+import click
+
+from app import create_app
+
+app = create_app()
+
+
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """
+    执行未执行的数据库迁移
+    """
+    from app.migrate import upgrade
+    for version, name in upgrade():
+        click.echo("migrated {}: {}".format(version, name))
+
+
+@app.cli.command("check-indexes")
+def check_indexes():
+    """
+    EXPLAIN 首页每种筛选/排序组合，出现全表扫描时以非零状态退出
+    """
+    from app.migrate import check_catalog_indexes
+    failures = check_catalog_indexes()
+    for p, problems in failures:
+        click.echo("{} -> {}".format(p, "; ".join(problems)))
+    if failures:
+        raise SystemExit(1)
+    click.echo("ok")
+
+
+@app.cli.command("search-reindex")
+def search_reindex():
+    """
+    重建电影搜索索引
+    """
+    from app import db
+    from app.search import rebuild_index
+    with db.engine.begin() as conn:
+        rebuild_index(conn)
+    click.echo("ok")
+
+
+@app.cli.command("images-backfill")
+def images_backfill():
+    """
+    为已有的封面和头像生成缩略图，放入任务队列由 flask jobs-worker 执行
+    """
+    from app import jobs
+    from app.models import Movie, Preview, User
+    items = [dict(filename=m.cover, kind="cover") for m in Movie.query.with_entities(Movie.cover)]
+    items += [dict(filename=p.cover, kind="cover") for p in Preview.query.with_entities(Preview.cover)]
+    items += [dict(filename=u.avatar, kind="avatar") for u in User.query.with_entities(User.avatar)]
+    items = [item for item in items if item["filename"]]
+    jobs.enqueue_many("derivatives", items)
+    click.echo("{} images queued".format(len(items)))
+
+
+@app.cli.command("uploads-migrate")
+@click.option("--batch", default=500, help="每批迁移并提交的行数")
+@click.option("--keep-old", is_flag=True, help="保留平铺目录中的旧文件")
+def uploads_migrate(batch, keep_old):
+    """
+    把平铺在上传目录中的旧文件迁入分片目录，可随时中断后重新执行
+    """
+    from app.storage import migrate_flat
+    for column, moved, missing in migrate_flat(batch=batch, keep=keep_old):
+        click.echo("{}: {} moved, {} missing".format(column, moved, missing))
+
+
+@app.cli.command("uploads-gc")
+@click.option("--grace", type=int, default=None, help="只删除超过该秒数未修改的文件，默认 UPLOAD_GC_GRACE")
+@click.option("--dry-run", is_flag=True, help="只列出将被删除的文件")
+def uploads_gc(grace, dry_run):
+    """
+    删除上传目录中没有被引用的文件
+    """
+    from app.storage import collect_garbage
+    count = total = 0
+    for path, size in collect_garbage(grace=grace, dry_run=dry_run):
+        click.echo("{} {}".format(path, size))
+        count += 1
+        total += size
+    click.echo("{} {} files, {} bytes".format("would remove" if dry_run else "removed", count, total))
+
+
+@app.cli.command("jobs-worker")
+@click.option("--workers", type=int, default=None, help="工作进程数，默认 JOB_WORKERS 或 CPU 核数")
+def jobs_worker(workers):
+    """
+    执行上传后处理等后台任务，一直运行直到被中断
+    """
+    from app.jobs import run_worker
+    run_worker(workers=workers)
+
+
+@app.cli.command("catalog-import")
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch", default=1000, help="每批导入并提交的条数")
+@click.option("--workers", default=8, help="并行处理文件的线程数")
+@click.option("--link", is_flag=True, help="建立硬链接而不是复制文件，与清单中的原文件共用 inode")
+def catalog_import(manifest, batch, workers, link):
+    """
+    从 CSV/JSON 清单批量导入标签、电影和预告，中断后重新执行即可继续
+    """
+    from app.importer import ManifestError, import_catalog
+    try:
+        for section, done, total in import_catalog(manifest, batch=batch, workers=workers, link=link):
+            click.echo("{}: {}/{}".format(section, done, total))
+    except ManifestError as e:
+        raise click.ClickException(str(e))
+
+
+@app.cli.command("logs-rollup")
+@click.option("--months", type=int, default=None, help="保留原始日志的月数（不含当月），默认 LOG_RETENTION_MONTHS 或 3")
+@click.option("--dry-run", is_flag=True, help="只列出将被汇总删除的分表")
+def logs_rollup(months, dry_run):
+    """
+    把保留期以外的日志月分表按天汇总后删除
+    """
+    from app.partitions import rollup
+    for name, rows, groups in rollup(months=months, dry_run=dry_run):
+        click.echo("{}: {} rows -> {} daily rows".format(name, rows, groups))
+
+
+@app.cli.command("check-startup")
+@click.option("--budget", type=int, default=None, help="导入耗时上限(毫秒)，默认 STARTUP_BUDGET_MS 或 800")
+@click.option("--runs", default=3, help="测量次数，取最快的一次")
+@click.option("--top", default=10, help="列出耗时最多的顶层导入数")
+def check_startup(budget, runs, top):
+    """
+    用 python -X importtime 测量冷启动导入 manage.py 的耗时，超过预算时以非零状态退出
+    """
+    from app.importtime import measure
+    budget = budget or app.config.get("STARTUP_BUDGET_MS", 800)
+    total, modules = measure("manage", runs=runs, cwd=os.path.dirname(os.path.abspath(__file__)))
+    for name, us in modules[:top]:
+        click.echo("{:8.1f} ms  {}".format(us / 1000.0, name))
+    click.echo("total {:.1f} ms, budget {} ms".format(total / 1000.0, budget))
+    if total > budget * 1000:
+        raise SystemExit(1)
 
 
 if __name__ == '__main__':